@@ -0,0 +1,9 @@
+"""Benchmarks, run from the repository root with `python -m benchmark.<name>`.
+
+- phases: per-phase timings and peak memory on generated corpora, with
+  JSON output and comparison against a baseline.
+- corpus: the deterministic HTML generator used by the benchmarks.
+- deep_nesting: rendering of deeply nested documents.
+- tree_memory: memory held by the parsed document tree.
+- startup: import time of the CLI, against a budget.
+"""
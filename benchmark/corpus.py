@@ -0,0 +1,106 @@
+"""Generates synthetic HTML documents for benchmarks.
+
+Usage: python -m benchmark.corpus [ELEMENTS] > page.html
+
+The same parameters always give the same document.
+"""
+
+import random
+import sys
+import typing as t
+from dataclasses import asdict, dataclass
+
+KNOWN_TAGS = ("div", "section", "article", "ul", "li", "p", "span", "a", "b", "em")
+UNKNOWN_TAGS = ("x-card", "my-widget", "app-root", "ng-view")
+ATTRIBUTES = ("class", "id", "href", "title", "data-id", "aria-label", "hidden")
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do".split()
+RAW_BLOCK = 2048
+
+
+@dataclass
+class Corpus:
+    """Shape of a generated document.
+
+    elements: Number of elements in the body.
+    depth: Maximum nesting depth of the body.
+    attributes: Average number of attributes per element.
+    raw_bytes: Total size of the script and style bodies.
+    unknown: Share of elements with a tag unknown to htmldoom.
+    seed: Seed of the random generator.
+    """
+
+    elements: int = 1000
+    depth: int = 8
+    attributes: float = 1.0
+    raw_bytes: int = 0
+    unknown: float = 0.0
+    seed: int = 0
+
+    def asdict(self) -> t.Dict[str, t.Any]:
+        return asdict(self)
+
+
+def _text(rnd: random.Random) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 8)))
+
+
+def _attributes(rnd: random.Random, corpus: Corpus) -> str:
+    count = int(corpus.attributes) + (rnd.random() < corpus.attributes % 1)
+    attrs = []
+    for name in rnd.sample(ATTRIBUTES, min(count, len(ATTRIBUTES))):
+        if name == "hidden":
+            attrs.append(name)
+        else:
+            attrs.append(f'{name}="{rnd.choice(WORDS)}-{rnd.randint(0, 99)}"')
+    return "".join(f" {attr}" for attr in attrs)
+
+
+def _raw_blocks(rnd: random.Random, corpus: Corpus) -> t.List[str]:
+    blocks, left = [], corpus.raw_bytes
+    while left > 0:
+        size = min(left, RAW_BLOCK)
+        words = []
+        while sum(len(w) + 1 for w in words) < size:
+            words.append(f"var {rnd.choice(WORDS)}{rnd.randint(0, 999)} = {{}};")
+        tag = rnd.choice(("script", "style"))
+        blocks.append(f"<{tag}>{' '.join(words)[:size]}</{tag}>")
+        left -= size
+    return blocks
+
+
+def generate(corpus: Corpus) -> str:
+    """Generates an HTML document of the given shape."""
+    rnd = random.Random(corpus.seed)
+    raw = _raw_blocks(rnd, corpus)
+    body, stack = [], []
+
+    for _ in range(corpus.elements):
+        # Close some of the open tags to spread the elements out.
+        while stack and (len(stack) >= corpus.depth or rnd.random() < 0.3):
+            body.append(f"</{stack.pop()}>")
+
+        unknown = rnd.random() < corpus.unknown
+        tag = rnd.choice(UNKNOWN_TAGS if unknown else KNOWN_TAGS)
+        body.append(f"<{tag}{_attributes(rnd, corpus)}>")
+        if rnd.random() < 0.5:
+            body.append(_text(rnd))
+            body.append(f"</{tag}>")
+        else:
+            stack.append(tag)
+
+    body.extend(f"</{tag}>" for tag in reversed(stack))
+    head = raw[: len(raw) // 2]
+    body.extend(raw[len(raw) // 2 :])
+
+    return (
+        "<!DOCTYPE html>\n<html>\n<head>\n<title>Benchmark</title>\n"
+        + "\n".join(head)
+        + "\n</head>\n<body>\n"
+        + "\n".join(body)
+        + "\n</body>\n</html>\n"
+    )
+
+
+if __name__ == "__main__":
+    elements = int(sys.argv[1]) if sys.argv[1:] else Corpus.elements
+    print(generate(Corpus(elements=elements)))
@@ -0,0 +1,84 @@
+"""Times rendering of deeply nested documents.
+
+Usage: python -m benchmark.deep_nesting [DEPTH ...]
+
+The recursive renderers that used to be in the converters are kept here for
+comparison. They fail with RecursionError once the nesting gets past the
+interpreter's recursion limit.
+"""
+
+import sys
+import time
+
+from moodlmth import yaml_converter
+from moodlmth.emitter import format_line
+from moodlmth.py_converter import TagLeaf, TagNode
+
+DEPTHS = (100, 900, 5000, 20000)
+
+
+def recursive_render(node):
+    if not node.children:
+        return f"{node.tagname}{node.tagattrs}"
+    children = ", ".join(
+        repr(c) if isinstance(c, TagLeaf) else recursive_render(c)
+        for c in node.children
+    )
+    return f"{node.tagname}{node.tagattrs}({children})"
+
+
+def recursive_render_yaml(node):
+    if isinstance(node, yaml_converter.CompositeTag):
+        return node.wrap([recursive_render_yaml(c) for c in node.children])
+    return node.render()
+
+
+def py_tree(depth):
+    root = node = TagNode("e.div")
+    for _ in range(depth):
+        child = TagNode("e.div", "(class_='x')")
+        node.addchild(child)
+        node = child
+    node.addchild(TagLeaf("b.txt", value="leaf"))
+    return root
+
+
+def yaml_tree(depth):
+    root = node = yaml_converter.CompositeTag("div", {}, [])
+    for _ in range(depth):
+        child = yaml_converter.CompositeTag("div", {"class": "x"}, [])
+        node.children.append(child)
+        node = child
+    node.children.append(yaml_converter.Txt("leaf"))
+    return root
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    try:
+        func(*args)
+    except RecursionError:
+        return "RecursionError"
+    return f"{time.perf_counter() - start:.4f}s"
+
+
+def main(depths=DEPTHS):
+    print(f"{'depth':>8} {'case':<12} {'recursive':>16} {'iterative':>12}")
+    for depth in depths:
+        tree = py_tree(depth)
+        print(
+            f"{depth:>8} {'python':<12} {timed(recursive_render, tree):>16}"
+            f" {timed(TagNode.render, tree):>12}"
+        )
+        tree = yaml_tree(depth)
+        print(
+            f"{depth:>8} {'yaml':<12} {timed(recursive_render_yaml, tree):>16}"
+            f" {timed(yaml_converter.CompositeTag.render, tree):>12}"
+        )
+        if depth <= 2000:
+            code = f"@renders({py_tree(depth).render()})"
+            print(f"{depth:>8} {'format':<12} {'-':>16} {timed(format_line, code):>12}")
+
+
+if __name__ == "__main__":
+    main([int(d) for d in sys.argv[1:]] or DEPTHS)
@@ -0,0 +1,234 @@
+"""Times each phase of the conversion on generated corpora.
+
+Usage: python -m benchmark.phases [--case NAME ...] [--output FILE]
+                                  [--baseline FILE] [--threshold RATIO]
+
+For both converters and each corpus, the phases are:
+
+- minify: the optional htmlmin pre-pass (null when htmlmin is not installed).
+- parse: feeding the document, which for python also serializes the sections.
+- render: turning the tree into output, i.e. formatting the generated code or
+  dumping components.yml and the raw assets.
+- template: the rest of generate(), filling the template in.
+- black: checking the result with black (null when black is not installed,
+  or when it runs out of recursion on a deeply nested result).
+
+Each phase keeps its best time out of --repeat runs. The peak memory of
+parse and generate is traced in a separate run. With --baseline, phases that
+got slower (or use more memory) by more than --threshold are reported and the
+exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as t
+import warnings
+from collections import defaultdict
+from contextlib import contextmanager
+
+from benchmark.corpus import Corpus, generate
+from moodlmth import __version__, py_converter, yaml_converter
+from moodlmth.assets import AssetStore
+from moodlmth.emitter import black_file_mode, format_with_black
+
+CASES = {
+    "small": Corpus(elements=200),
+    "large": Corpus(elements=20000),
+    "deep": Corpus(elements=5000, depth=200),
+    "attributes": Corpus(elements=5000, attributes=4),
+    "scripts": Corpus(elements=2000, raw_bytes=512 * 1024),
+    "unknown": Corpus(elements=5000, unknown=0.3),
+}
+CONVERTERS = ("python", "yaml")
+RENDER_FUNCTIONS = {
+    "python": [(py_converter, "format_statement")],
+    "yaml": [
+        (yaml_converter, "format_statement"),
+        (yaml_converter, "dump_document"),
+        (AssetStore, "put"),
+    ],
+}
+PHASES = ("minify", "parse", "render", "template", "black")
+MIN_DIFFERENCE = {"time": 0.005, "memory": 64 * 1024}
+
+
+@contextmanager
+def timed_calls(
+    targets: t.List[t.Tuple[t.Any, str]], timings: t.Dict[str, float], phase: str
+) -> t.Iterator[None]:
+    """Adds the time spent in the given functions to `timings[phase]`."""
+    originals = [(owner, name, getattr(owner, name)) for owner, name in targets]
+
+    def wrap(function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings[phase] += time.perf_counter() - start
+
+        return wrapper
+
+    for owner, name, function in originals:
+        setattr(owner, name, wrap(function))
+    try:
+        yield
+    finally:
+        for owner, name, function in originals:
+            setattr(owner, name, function)
+
+
+def optional_phase(function: t.Callable[[], t.Any]) -> t.Optional[float]:
+    """Times a phase, or gives None when it can't run on this case."""
+    start = time.perf_counter()
+    try:
+        function()
+    except (ImportError, RecursionError):
+        return None
+    return time.perf_counter() - start
+
+
+def minify(raw_html: str) -> None:
+    from htmlmin import minify
+
+    minify(raw_html, remove_empty_space=True)
+
+
+def check_with_black(result: str) -> None:
+    format_with_black(result, fast=True, mode=black_file_mode())
+
+
+def make_converter(name: str, assets: str) -> t.Any:
+    if name == "yaml":
+        return yaml_converter.Converter(assets=assets)
+    return py_converter.Converter()
+
+
+def convert(name: str, raw_html: str, assets: str) -> str:
+    converter = make_converter(name, assets)
+    converter.feed(raw_html)
+    converter.close()
+    return converter.generate()
+
+
+def time_phases(name: str, raw_html: str, assets: str) -> t.Dict[str, t.Any]:
+    timings: t.Dict[str, t.Any] = defaultdict(float)
+    timings["minify"] = optional_phase(lambda: minify(raw_html))
+
+    converter = make_converter(name, assets)
+    start = time.perf_counter()
+    converter.feed(raw_html)
+    converter.close()
+    timings["parse"] = time.perf_counter() - start
+
+    with timed_calls(RENDER_FUNCTIONS[name], timings, "render"):
+        start = time.perf_counter()
+        result = converter.generate()
+        timings["template"] = time.perf_counter() - start - timings["render"]
+
+    timings["black"] = optional_phase(lambda: check_with_black(result))
+    return timings
+
+
+def peak_memory(name: str, raw_html: str, assets: str) -> int:
+    tracemalloc.start()
+    try:
+        convert(name, raw_html, assets)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(corpus: Corpus, repeat: int) -> t.Dict[str, t.Dict[str, t.Any]]:
+    raw_html = generate(corpus)
+    results = {}
+    for name in CONVERTERS:
+        with tempfile.TemporaryDirectory() as assets:
+            runs = [time_phases(name, raw_html, assets) for _ in range(repeat)]
+            result: t.Dict[str, t.Any] = {}
+            for phase in PHASES:
+                times = [run[phase] for run in runs if run[phase] is not None]
+                result[phase] = min(times) if times else None
+            result["total"] = sum(v for v in result.values() if v is not None)
+            result["peak_memory"] = peak_memory(name, raw_html, assets)
+        results[name] = result
+    return results
+
+
+def compare(
+    baseline: t.Dict[str, t.Any], current: t.Dict[str, t.Any], threshold: float
+) -> t.List[str]:
+    """Lists the phases that regressed compared to the baseline."""
+    regressions = []
+    for case, converters in current["results"].items():
+        for name, phases in converters.items():
+            old_phases = baseline["results"].get(case, {}).get(name, {})
+            for phase, new in phases.items():
+                old = old_phases.get(phase)
+                if old is None or new is None:
+                    continue
+                kind = "memory" if phase == "peak_memory" else "time"
+                if new > old * (1 + threshold) and new - old > MIN_DIFFERENCE[kind]:
+                    regressions.append(
+                        f"{case}/{name}/{phase}: {old:.4g} -> {new:.4g}"
+                        f" (+{(new - old) / old:.0%})"
+                    )
+    return regressions
+
+
+def report(results: t.Dict[str, t.Any]) -> None:
+    columns = PHASES + ("total",)
+    header = "".join(f"{column:>10}" for column in columns + ("peak MiB",))
+    print(f"{'case':<12}{'converter':<10}{header}")
+    for case, converters in results["results"].items():
+        for name, phases in converters.items():
+            cells = [
+                "-" if phases[column] is None else f"{phases[column] * 1000:.1f}ms"
+                for column in columns
+            ]
+            cells.append(f"{phases['peak_memory'] / 2 ** 20:.1f}")
+            print(f"{case:<12}{name:<10}" + "".join(f"{c:>10}" for c in cells))
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser("benchmark.phases")
+    parser.add_argument("--case", action="append", choices=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with results from this file")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = {
+        "moodlmth": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpora": {name: CASES[name].asdict() for name in args.case or CASES},
+        "results": {},
+    }
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name in args.case or CASES:
+            results["results"][name] = run_case(CASES[name], args.repeat)
+
+    report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Checks how long importing the CLI takes.
+
+Usage: python -m benchmark.startup [BUDGET_MS]
+
+Runs `python -X importtime -c "import moodlmth.cli"` a few times and reports
+the best cumulative import time of moodlmth.cli. Exits with status 1 when it
+is over the budget, or when one of the heavy dependencies that the CLI should
+only load on demand got imported.
+"""
+
+import subprocess
+import sys
+
+BUDGET_MS = 60.0
+RUNS = 5
+MODULE = "moodlmth.cli"
+LAZY_MODULES = (
+    "requests",
+    "black",
+    "htmlmin",
+    "yaml",
+    "htmldoom",
+    "moodlmth.batch",
+    "multiprocessing",
+)
+
+
+def import_times(module=MODULE):
+    """Cumulative import time in microseconds of each module `module` loads."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(budget_ms=BUDGET_MS):
+    runs = [import_times() for _ in range(RUNS)]
+    best_ms = min(times[MODULE] for times in runs) / 1000
+    loaded = sorted(
+        name
+        for name in runs[-1]
+        if any(name == lazy or name.startswith(f"{lazy}.") for lazy in LAZY_MODULES)
+    )
+
+    print(f"import {MODULE}: {best_ms:.1f}ms (budget: {budget_ms:.1f}ms)")
+    if loaded:
+        print(f"Imported eagerly: {', '.join(loaded)}")
+    if loaded or best_ms > budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if sys.argv[1:] else BUDGET_MS)
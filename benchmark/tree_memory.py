@@ -0,0 +1,50 @@
+"""Measures the memory held by the parsed document tree.
+
+Usage: python -m benchmark.tree_memory [ROWS]
+
+Parses a generated table of ROWS rows (one element and one text node per
+cell) with each converter and reports the traced memory held once parsing
+is done, per node. Sections are serialized when they close, so the page is
+wrapped in a plain <div> to keep the whole tree alive.
+"""
+
+import sys
+import tracemalloc
+import warnings
+
+from moodlmth import py_converter, yaml_converter
+
+ROWS = 20000
+COLS = 5
+
+
+def document(rows):
+    cells = "".join(f"<td class='c{i}'>cell {i}</td>" for i in range(COLS))
+    return "<div><table>" + f"<tr>{cells}</tr>" * rows + "</table></div>"
+
+
+def measure(converter, raw_html):
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    converter.feed(raw_html)
+    converter.close()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return held - start, peak - start
+
+
+def main(rows=ROWS):
+    raw_html = document(rows)
+    nodes = 2 + rows * (1 + COLS * 2)
+
+    print(f"{nodes} nodes")
+    print(f"{'converter':<10} {'held':>12} {'peak':>12} {'bytes/node':>12}")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name, module in (("python", py_converter), ("yaml", yaml_converter)):
+            held, peak = measure(module.Converter(), raw_html)
+            print(f"{name:<10} {held:>12} {peak:>12} {held / nodes:>12.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else ROWS)
@@ -11,4 +11,16 @@ __all__ = [
     "__description__",
     "__version__",
     "__license__",
+    "Converted",
+    "convert_many",
 ]
+
+
+def __getattr__(name):
+    # Batch conversion loads the process pool machinery, which the CLI only
+    # needs for some runs.
+    if name in {"Converted", "convert_many"}:
+        from moodlmth import batch
+
+        return getattr(batch, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,103 @@
+"Stores the assets of YAML conversions by their content."
+
+import hashlib
+import os
+import tempfile
+import threading
+import typing as t
+from contextlib import contextmanager
+
+DEFAULT_DIRECTORY = "assets"
+NAME_LENGTH = 20
+
+
+class AssetWriter:
+    """A text stream that hashes what is written through it."""
+
+    # Tells libyaml's emitter to write text, not bytes.
+    encoding = None
+
+    def __init__(self, stream: t.TextIO, suffix: str) -> None:
+        self.stream = stream
+        self.suffix = suffix
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    def write(self, data: str) -> None:
+        encoded = data.encode("utf-8", "surrogatepass")
+        self._digest.update(encoded)
+        self.size += len(encoded)
+        self.stream.write(data)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    @property
+    def name(self) -> str:
+        return f"{self._digest.hexdigest()[:NAME_LENGTH]}{self.suffix}"
+
+
+class AssetStore:
+    """A directory of files named after the hash of their content.
+
+    The same content is stored once and shared by every document that uses it.
+    Files are written under a temporary name and renamed into place, so any
+    number of conversions, threads or processes can share one store.
+
+    Example:
+
+        >>> store = AssetStore("assets")
+        >>> store.put("body { color: red }", suffix=".txt")
+        '925e8741be6978ff901b.txt'
+    """
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY) -> None:
+        self.directory = directory
+        self.written = 0
+        self._known: t.Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _exists(self, name: str) -> bool:
+        with self._lock:
+            if name in self._known:
+                return True
+        if os.path.exists(os.path.join(self.directory, name)):
+            with self._lock:
+                self._known.add(name)
+            return True
+        return False
+
+    def _commit(self, tmp: str, name: str) -> None:
+        if self._exists(name):
+            os.unlink(tmp)
+            return
+        os.replace(tmp, os.path.join(self.directory, name))
+        with self._lock:
+            self._known.add(name)
+            self.written += 1
+
+    @contextmanager
+    def writer(self, suffix: str = ".txt") -> t.Iterator[AssetWriter]:
+        """Writes an asset whose content is only known once it is written.
+
+        The name is available as `writer.name` after the block.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                writer = AssetWriter(f, suffix)
+                yield writer
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._commit(tmp, writer.name)
+
+    def put(self, content: str, suffix: str = ".txt") -> str:
+        """Stores the content unless it already is and returns its file name."""
+        digest = hashlib.sha256(content.encode("utf-8", "surrogatepass"))
+        name = f"{digest.hexdigest()[:NAME_LENGTH]}{suffix}"
+        if not self._exists(name):
+            with self.writer(suffix) as writer:
+                writer.write(content)
+        return name
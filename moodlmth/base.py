@@ -0,0 +1,265 @@
+"Parsing machinery shared by the converters."
+
+import codecs
+import re
+import string
+import time
+import typing as t
+from functools import lru_cache
+from html.parser import HTMLParser
+
+from moodlmth.const import PRE_TAGS
+from moodlmth.diagnostics import NULL_DIAGNOSTICS, Diagnostics
+from moodlmth.emitter import black_file_mode
+from moodlmth.limits import CLOCK_INTERVAL, NO_LIMITS, LimitExceeded, Limits, utf8_size
+from moodlmth.stats import NULL_STATS, Stats
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r"[ \t\n\r\f]+")
+
+
+def iter_file(path: str, chunk_size: int = CHUNK_SIZE) -> t.Iterator[bytes]:
+    """Reads a file in binary chunks."""
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(chunk_size), b"")
+
+
+@lru_cache(maxsize=None)
+def template_parts(template: str) -> t.Tuple[t.Tuple[str, t.Optional[str]], ...]:
+    """Splits a `str.format` template into (literal text, field name) pairs."""
+    return tuple(
+        (literal, name) for literal, name, _, _ in string.Formatter().parse(template)
+    )
+
+
+def iter_template(
+    parts: t.Iterable[t.Tuple[str, t.Optional[str]]],
+    fields: t.Mapping[str, t.Callable[[], str]],
+) -> t.Iterator[str]:
+    """Fills a template split by `template_parts` in piece by piece.
+
+    Each field is made by calling its function only when the template gets to
+    it, so the pieces can be written out before the next one is made.
+    """
+    for literal, name in parts:
+        if literal:
+            yield literal
+        if name is not None:
+            yield fields[name]()
+
+
+class BaseConverter(HTMLParser):
+    htmlmin: bool = False
+    diagnose: bool = True
+    stats: Stats = NULL_STATS
+    limits: Limits = NO_LIMITS
+
+    def reset(self) -> None:
+        super().reset()
+        self.diagnostics = Diagnostics() if self.diagnose else NULL_DIAGNOSTICS
+        self._pre_depth = 0
+        self._collapse_whitespace = True
+        self._bytes_in = 0
+        self._nodes = 0
+        self._deadline: t.Optional[float] = None
+        if self.limits.timeout is not None:
+            self._deadline = time.monotonic() + self.limits.timeout
+
+    def count_input(self, size: int) -> None:
+        """Counts input bytes against the limits (and the stats)."""
+        self.stats.count("bytes_in", size)
+        self._bytes_in += size
+        if self.limits.max_bytes is not None and self._bytes_in > self.limits.max_bytes:
+            raise LimitExceeded("max_bytes", self.limits.max_bytes)
+
+    def count_node(self, depth: int) -> None:
+        """Counts a node parsed at `depth` against the limits."""
+        limits = self.limits
+        if limits is NO_LIMITS:
+            return
+        self._nodes += 1
+        if limits.max_nodes is not None and self._nodes > limits.max_nodes:
+            raise LimitExceeded("max_nodes", limits.max_nodes)
+        if limits.max_depth is not None and depth > limits.max_depth:
+            raise LimitExceeded("max_depth", limits.max_depth)
+        if not self._nodes % CLOCK_INTERVAL:
+            self.check_time()
+
+    def count_output(self, size: int) -> None:
+        """Checks the size of the output generated so far against the limits."""
+        if self.limits.max_output is not None and size > self.limits.max_output:
+            raise LimitExceeded("max_output", self.limits.max_output)
+
+    def check_time(self) -> None:
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            raise LimitExceeded("timeout", self.limits.timeout)
+
+    def enter_tag(self, tag: str) -> None:
+        if tag in PRE_TAGS:
+            self._pre_depth += 1
+
+    def leave_tag(self, tag: str) -> None:
+        if tag in PRE_TAGS and self._pre_depth:
+            self._pre_depth -= 1
+
+    def collapse_whitespace(
+        self, data: str, strip: bool = False, drop_blank: bool = False
+    ) -> str:
+        """Collapses whitespace in text the way htmlmin's remove_empty_space does.
+
+        Whitespace-only text spanning lines is dropped, as is any whitespace-only
+        text with `drop_blank` (htmlmin drops it all inside the head). Other
+        whitespace runs become a single space, and text inside PRE_TAGS is
+        kept as is.
+        """
+        if not self._collapse_whitespace or self._pre_depth:
+            return data
+        blank = not WHITESPACE.sub("", data)
+        if blank and (drop_blank or "\n" in data or "\r" in data):
+            return ""
+        data = WHITESPACE.sub(" ", data)
+        return data.strip(" ") if strip else data
+
+    @property
+    def black_file_mode(self) -> t.Any:
+        """The black.FileMode of the output. Accessing it imports black."""
+        return black_file_mode()
+
+    def convert(self, raw_html: str) -> str:
+        """Do the conversion.
+
+        raw_html: The raw html text to convert.
+
+        The converter starts from a clean state, so it can convert any number
+        of documents one after another.
+        """
+        self._parse(raw_html)
+        return self.finish(self.generate())
+
+    def convert_to(self, raw_html: str, stream: t.TextIO) -> None:
+        """Do the conversion, writing the output to a text stream.
+
+        raw_html: The raw html text to convert.
+        stream: File-like object the output is written to.
+
+        The output is written piece by piece as it is generated, instead of
+        being returned as one string.
+        """
+        self._parse(raw_html)
+        self.finish_to(stream)
+
+    def _parse(self, raw_html: str) -> None:
+        """Parses a whole document, from a clean state."""
+        self.reset()
+        if self.stats.enabled or self.limits.max_bytes is not None:
+            self.count_input(utf8_size(raw_html, self.limits.max_bytes))
+
+        if self.htmlmin:
+            with self.stats.phase("minify"):
+                from htmlmin import minify
+
+                raw_html = minify(raw_html, remove_empty_space=True)
+            self._collapse_whitespace = False
+            self.check_time()
+
+        with self.stats.phase("parse"):
+            self.feed(raw_html)
+            self.close()
+
+    def finish(self, result: str) -> str:
+        """Reports the diagnostics and records the end of the conversion."""
+        self.check_time()
+        if self.stats.enabled or self.limits.max_output is not None:
+            size = utf8_size(result, self.limits.max_output)
+            self.count_output(size)
+            self.stats.count("bytes_out", size)
+        self.diagnostics.report(self.log)
+        self.stats.done()
+        return result
+
+    def finish_to(self, stream: t.TextIO) -> None:
+        """Like `finish`, but generates the output into a text stream.
+
+        If a limit is exceeded on the way, the stream keeps what was written.
+        """
+        measure = self.stats.enabled or self.limits.max_output is not None
+        size = 0
+        for piece in self.iter_generate():
+            if measure:
+                size += utf8_size(piece)
+                self.count_output(size)
+            stream.write(piece)
+        self.check_time()
+        self.stats.count("bytes_out", size)
+        self.diagnostics.report(self.log)
+        self.stats.done()
+
+    def feed_stream(
+        self, chunks: t.Iterable[t.Union[bytes, str]], encoding: str = "utf-8"
+    ) -> None:
+        """Feeds the parser chunk by chunk, decoding bytes incrementally.
+
+        Only the current chunk and the parser's unprocessed tail are held in
+        memory, so the input never has to be read as a whole.
+        """
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pending = ""
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                self.count_input(len(chunk))
+                chunk = decoder.decode(chunk)
+            elif self.stats.enabled or self.limits.max_bytes is not None:
+                self.count_input(utf8_size(chunk))
+            self.check_time()
+            pending += chunk
+
+            # HTMLParser reports text as soon as it is fed, so hand over only
+            # up to the last "<" where the current run of text is known to end.
+            cut = pending.rfind("<")
+            if cut > 0:
+                self.feed(pending[:cut])
+                pending = pending[cut:]
+
+        self.feed(pending + decoder.decode(b"", final=True))
+        self.close()
+
+    def convert_stream(
+        self, chunks: t.Iterable[t.Union[bytes, str]], encoding: str = "utf-8"
+    ) -> str:
+        """Do the conversion while the input is still arriving.
+
+        chunks: Iterable of bytes or text, e.g. from `iter_file()` or an HTTP body.
+        encoding: Used to decode the byte chunks.
+
+        Whitespace is always collapsed while parsing here, as the htmlmin
+        pre-pass needs the whole document. The "parse" phase of the stats
+        includes the time spent waiting for the chunks.
+        """
+        self._parse_stream(chunks, encoding=encoding)
+        return self.finish(self.generate())
+
+    def convert_stream_to(
+        self,
+        chunks: t.Iterable[t.Union[bytes, str]],
+        stream: t.TextIO,
+        encoding: str = "utf-8",
+    ) -> None:
+        """Like `convert_stream`, but writes the output like `convert_to`."""
+        self._parse_stream(chunks, encoding=encoding)
+        self.finish_to(stream)
+
+    def _parse_stream(
+        self, chunks: t.Iterable[t.Union[bytes, str]], encoding: str = "utf-8"
+    ) -> None:
+        """Parses a document from its chunks, from a clean state."""
+        self.reset()
+        with self.stats.phase("parse"):
+            self.feed_stream(chunks, encoding=encoding)
+
+    def generate(self) -> str:
+        """Generates the output from what has been parsed so far."""
+        return "".join(self.iter_generate())
+
+    def iter_generate(self) -> t.Iterator[str]:
+        """Generates the output piece by piece, e.g. section by section."""
+        raise NotImplementedError  # pragma: nocover
@@ -0,0 +1,411 @@
+"Converts many documents in parallel."
+
+import glob
+import itertools
+import logging
+import os
+import pickle
+import queue
+import re
+import threading
+import typing as t
+import uuid
+from argparse import Namespace
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from contextlib import ExitStack, contextmanager, suppress
+from dataclasses import dataclass, replace
+from functools import partial
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from moodlmth.const import Syntax
+from moodlmth.http_cache import Revalidated
+
+HTML_SUFFIXES = {".html", ".htm", ".xhtml"}
+DEFAULT_CHUNKSIZE = 16
+
+
+@dataclass
+class Job:
+    source: str
+    destination: str
+
+
+@dataclass
+class Result:
+    source: str
+    destination: str
+    error: t.Optional[str] = None
+    stats: t.Optional[t.Dict[str, t.Dict[str, t.Any]]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class Converted:
+    index: int
+    output: t.Optional[str] = None
+    error: t.Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def available_cpus() -> int:
+    """Number of cores this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1  # pragma: nocover
+
+
+def is_url(target: str) -> bool:
+    return target.startswith("http://") or target.startswith("https://")
+
+
+def _url_to_name(url: str) -> str:
+    parts = urlsplit(url)
+    name = f"{parts.netloc}{parts.path}".rstrip("/")
+    if parts.query:
+        name = f"{name}?{parts.query}"
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+def expand_targets(targets: t.Iterable[str]) -> t.Iterator[t.Tuple[str, str]]:
+    """Yields (source, output name) pairs for files, directories, globs and URLs.
+
+    Directories are searched recursively for HTML files and keep their layout
+    relative to the directory in the output name.
+    """
+    for target in targets:
+        if is_url(target):
+            yield target, _url_to_name(target)
+        elif os.path.isdir(target):
+            root = Path(target)
+            for path in sorted(root.rglob("*")):
+                if path.suffix.lower() in HTML_SUFFIXES and path.is_file():
+                    yield str(path), str(path.relative_to(root).with_suffix(""))
+        elif glob.has_magic(target):
+            for path in sorted(glob.glob(target, recursive=True)):
+                if os.path.isfile(path):
+                    yield path, Path(path).stem
+        else:
+            yield target, Path(target).stem
+
+
+def plan_jobs(
+    targets: t.Iterable[str], outdir: str, suffix: str = ".py"
+) -> t.List[Job]:
+    """Maps every target to a unique destination inside `outdir`."""
+    jobs, seen = [], set()
+    for source, name in expand_targets(targets):
+        destination = os.path.join(outdir, f"{name}{suffix}")
+        count = 1
+        while destination in seen:
+            destination = os.path.join(outdir, f"{name}-{count}{suffix}")
+            count += 1
+        seen.add(destination)
+        jobs.append(Job(source=source, destination=destination))
+    return jobs
+
+
+@contextmanager
+def _writer(destination: str) -> t.Iterator[t.TextIO]:
+    # Written under a temporary name, so a failed conversion leaves no partial
+    # output behind.
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    tmp = f"{destination}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, "x") as f:
+            yield f
+        os.replace(tmp, destination)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+
+
+def _convert_job(
+    job: Job,
+    options: Namespace,
+    content: t.Optional[str] = None,
+    page: t.Optional[Revalidated] = None,
+) -> Result:
+    # Runs in a worker process. The converter modules (and black with them) are
+    # imported by the first job and stay loaded for the rest of the batch.
+    from moodlmth.cli import cache_settings, load_converter, load_http_cache
+    from moodlmth.stats import NULL_STATS, Stats
+
+    if options.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    stats = Stats() if options.stats else NULL_STATS
+    try:
+        if content is None:
+            with stats.phase("read"), open(job.source) as f:
+                content = f.read()
+        if not content:
+            raise ValueError("No content found")
+        converter = load_converter(
+            options, logger=logging.getLogger(__name__), stats=stats
+        )
+        if page is not None:
+            result = converter.convert(content)
+            load_http_cache(options).store(
+                job.source, cache_settings(options), page, result
+            )
+            with stats.phase("write"), _writer(job.destination) as f:
+                print(result, file=f)
+        else:
+            with _writer(job.destination) as f:
+                converter.convert_to(content, f)
+                print(file=f)
+    except Exception as e:
+        return Result(job.source, job.destination, error=f"{type(e).__name__}: {e}")
+    return Result(
+        job.source, job.destination, stats=stats.asdict() if stats.enabled else None
+    )
+
+
+def _fetch(
+    url_jobs: t.Dict[str, t.List[Job]], options: Namespace
+) -> t.Iterator[
+    t.Tuple[Job, t.Optional[str], t.Optional[Revalidated], t.Optional[Result]]
+]:
+    """Downloads the URL jobs as (job, content, page, result) tuples.
+
+    Jobs that need no conversion come with their `result`: failed downloads,
+    and pages written from the HTTP cache because they did not change.
+    """
+    from moodlmth.cli import cache_settings, load_http_cache
+    from moodlmth.fetch import Fetcher
+
+    cache = load_http_cache(options) if options.http_cache else None
+    with Fetcher(concurrency=options.concurrency, timeout=options.timeout) as f:
+        get = f.get
+        if cache is not None:
+            get = partial(cache.revalidate, f, settings=cache_settings(options))
+
+        for url, fetched, error in f.fetch_many(url_jobs, get=get):
+            for job in url_jobs[url]:
+                if error:
+                    yield job, None, None, Result(job.source, job.destination, error)
+                elif cache is None:
+                    yield job, fetched, None, None
+                elif fetched.output is None:
+                    # Only the validators are needed to cache the output.
+                    yield job, fetched.content, replace(fetched, content=None), None
+                else:
+                    try:
+                        with _writer(job.destination) as f:
+                            print(fetched.output, file=f)
+                    except OSError as e:
+                        error = f"{type(e).__name__}: {e}"
+                    yield job, None, None, Result(job.source, job.destination, error)
+
+
+def _fetch_into(
+    events: "queue.Queue[t.Any]",
+    url_jobs: t.Dict[str, t.List[Job]],
+    options: Namespace,
+    stop: threading.Event,
+) -> None:
+    # Runs in a thread, so the downloads don't hold back the results of the
+    # conversions. None marks the end, an exception is raised by the reader.
+    try:
+        for item in _fetch(url_jobs, options):
+            if stop.is_set():
+                break
+            events.put(item)
+    except BaseException as e:
+        events.put(e)
+    finally:
+        events.put(None)
+
+
+def run(
+    jobs: t.Sequence[Job],
+    options: Namespace,
+    workers: t.Optional[int] = None,
+    executor: t.Optional[Executor] = None,
+) -> t.Iterator[Result]:
+    """Converts the jobs on a process pool and yields results as they finish.
+
+    URLs are downloaded concurrently in a thread (see `moodlmth.fetch`) and
+    each page is handed to the pool as soon as it arrives. With an HTTP cache,
+    pages that did not change are written from it without being converted.
+    A failing document is reported through its result instead of stopping the
+    remaining jobs. Runs that share an `executor` reuse its warm workers.
+    """
+    url_jobs: t.Dict[str, t.List[Job]] = {}
+    for job in jobs:
+        if is_url(job.source):
+            url_jobs.setdefault(job.source, []).append(job)
+
+    with ExitStack() as stack:
+        if executor is None:
+            workers = min(workers or available_cpus(), len(jobs)) or 1
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+
+        # Downloaded pages and finished conversions arrive on one queue, so
+        # every result is yielded as soon as it is ready.
+        events: "queue.Queue[t.Any]" = queue.Queue()
+        pending = 0
+        for job in jobs:
+            if not is_url(job.source):
+                executor.submit(_convert_job, job, options).add_done_callback(
+                    events.put
+                )
+                pending += 1
+
+        fetching = bool(url_jobs)
+        if fetching:
+            stop = threading.Event()
+            stack.callback(stop.set)
+            threading.Thread(
+                target=_fetch_into, args=(events, url_jobs, options, stop), daemon=True
+            ).start()
+
+        while fetching or pending:
+            event = events.get()
+            if isinstance(event, Future):
+                pending -= 1
+                yield event.result()
+            elif event is None:
+                fetching = False
+            elif isinstance(event, BaseException):
+                raise event
+            else:
+                job, content, page, result = event
+                if result is not None:
+                    yield result
+                    continue
+                executor.submit(
+                    _convert_job, job, options, content, page
+                ).add_done_callback(events.put)
+                pending += 1
+
+
+# The converter of a worker process, with the token of the convert_many() call
+# it was created for.
+_worker: t.Tuple[t.Optional[str], t.Any] = (None, None)
+
+
+def _convert_chunk(
+    token: str,
+    syntax: Syntax,
+    options: t.Dict[str, t.Any],
+    chunk: t.List[t.Tuple[int, str]],
+) -> t.List[Converted]:
+    # Runs in a worker process, which keeps its converter for the next chunks.
+    global _worker
+    if _worker[0] != token:
+        if syntax is Syntax.python:
+            from moodlmth.py_converter import Converter
+        else:
+            from moodlmth.yaml_converter import Converter
+        _worker = (token, Converter(**options))
+
+    converter, results = _worker[1], []
+    for index, raw_html in chunk:
+        try:
+            results.append(Converted(index, output=converter.convert(raw_html)))
+        except Exception as e:
+            results.append(Converted(index, error=f"{type(e).__name__}: {e}"))
+    return results
+
+
+def convert_many(
+    documents: t.Iterable[str],
+    syntax: Syntax = Syntax.python,
+    workers: t.Optional[int] = None,
+    ordered: bool = False,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    **options: t.Any,
+) -> t.Iterator[Converted]:
+    """Converts documents on a process pool and yields them as they finish.
+
+    documents: Iterable of raw HTML, read as the workers need more.
+    syntax: Output syntax.
+    workers: Number of processes (default: all cores).
+    ordered: Yield in the order of `documents` instead of as they finish.
+    chunksize: Number of documents sent to a worker at once.
+    options: Passed to the converters, e.g. fast=True. They are pickled to
+        reach the workers, so objects holding locks or open files, like a
+        FormatCache, are rejected with a ValueError.
+
+    Each result carries the index of its document. A failing document is
+    reported through the `error` of its result, the others still convert.
+    Every worker reuses one converter for all its documents.
+
+    Example:
+
+        >>> for converted in convert_many(pages, syntax=Syntax.yaml, fast=True):
+        ...     print(converted.index, converted.error or len(converted.output))
+    """
+    if chunksize < 1:
+        raise ValueError(f"Chunk size must be at least 1: {chunksize}")
+    try:
+        pickle.dumps(options)
+    except Exception as e:
+        raise ValueError(f"Options must be picklable to reach the workers: {e}")
+    return _convert_many(
+        documents, syntax, workers or available_cpus(), ordered, chunksize, options
+    )
+
+
+def _convert_many(
+    documents: t.Iterable[str],
+    syntax: Syntax,
+    workers: int,
+    ordered: bool,
+    chunksize: int,
+    options: t.Dict[str, t.Any],
+) -> t.Iterator[Converted]:
+    token = uuid.uuid4().hex
+    indexed = enumerate(documents)
+    chunks = iter(lambda: list(itertools.islice(indexed, chunksize)), [])
+
+    # Only a couple of chunks per worker are read ahead, and in order, only so
+    # many results are held back waiting for an earlier one.
+    window = 2 * workers
+    pending: t.Dict[t.Any, t.List[int]] = {}
+    held: t.Dict[int, Converted] = {}
+    next_index = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while len(pending) < window and len(held) < window * chunksize:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                future = executor.submit(_convert_chunk, token, syntax, options, chunk)
+                pending[future] = [index for index, _ in chunk]
+            if not pending:
+                return
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                indexes = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    results = [Converted(index, error=error) for index in indexes]
+
+                if not ordered:
+                    yield from results
+                    continue
+                for result in results:
+                    held[result.index] = result
+                while next_index in held:
+                    yield held.pop(next_index)
+                    next_index += 1
@@ -0,0 +1,188 @@
+"Memoizes formatted code fragments."
+
+import hashlib
+import os
+import tempfile
+import threading
+import typing as t
+from collections import OrderedDict
+
+# In characters of formatted code kept in memory.
+DEFAULT_MAX_MEMORY = 32 * 1024 * 1024
+# In bytes of files kept in a cache directory.
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+_shared: t.Dict[t.Optional[str], "FormatCache"] = {}
+_shared_lock = threading.Lock()
+
+
+class BoundedDirectory:
+    """Keeps a directory of cache files under `max_size` bytes.
+
+    Sizes are tracked incrementally, the directory is only listed when it
+    seems full, so files written by other processes are accounted for. Files
+    are evicted by modification time, which readers update with `touch`.
+    """
+
+    def __init__(self, directory: str, suffix: str, max_size: int) -> None:
+        self.directory = directory
+        self.suffix = suffix
+        self.max_size = max_size
+        self._size: t.Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def touch(path: str) -> None:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def added(self, size: int) -> None:
+        """Accounts for a new file of `size` bytes, evicting if needed."""
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _scan(self) -> t.Tuple[t.List[t.Tuple[float, int, str]], int]:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries, sum(size for _, size, _ in entries)
+
+    def _evict(self) -> None:
+        entries, self._size = self._scan()
+        for _, size, path in sorted(entries):
+            if self._size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+class FormatCache:
+    """An LRU cache of formatted fragments, optionally backed by a directory.
+
+    Sections that repeat across pages (title, head, shared parts of the body)
+    are formatted once and reused. At most `max_memory` characters of them
+    are kept in memory. Entries that fall out of memory are still found in
+    `directory`, which may be shared by several processes and is kept under
+    `max_size` bytes.
+
+    Example:
+
+        >>> cache = FormatCache(directory=".moodlmth-cache")
+        >>> Converter(cache=cache).convert(raw_html)
+        >>> cache.hits, cache.misses
+    """
+
+    def __init__(
+        self,
+        max_memory: int = DEFAULT_MAX_MEMORY,
+        directory: t.Optional[str] = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ) -> None:
+        self.max_memory = max_memory
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+        self._disk: t.Optional[BoundedDirectory] = None
+        if directory is not None:
+            self._disk = BoundedDirectory(directory, ".txt", max_size)
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def get(self, key: str) -> t.Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        BoundedDirectory.touch(path)
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._remember(key, value)
+        if self._disk is None:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(value)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        self._disk.added(size)
+
+    def _remember(self, key: str, value: str) -> None:
+        if len(value) > self.max_memory:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._memory -= len(old)
+            self._entries[key] = value
+            self._memory += len(value)
+            while self._memory > self.max_memory:
+                _, evicted = self._entries.popitem(last=False)
+                self._memory -= len(evicted)
+
+    def get_or_format(self, key: str, format_: t.Callable[[], str]) -> str:
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            self.misses += 1
+        value = format_()
+        self.put(key, value)
+        return value
+
+
+def shared_cache(
+    directory: t.Optional[str] = None, max_size: int = DEFAULT_MAX_SIZE
+) -> FormatCache:
+    """Returns the cache shared by every conversion in this process."""
+    with _shared_lock:
+        if directory not in _shared:
+            _shared[directory] = FormatCache(directory=directory, max_size=max_size)
+        return _shared[directory]
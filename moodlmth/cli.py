@@ -1,18 +1,42 @@
 import logging
 import os
 import sys
+import typing as t
 from argparse import ArgumentError, ArgumentParser, FileType
-
-import requests
+from functools import lru_cache
 
 from moodlmth import __version__
-from moodlmth.const import Syntax
+from moodlmth.assets import DEFAULT_DIRECTORY
+from moodlmth.base import iter_file
+from moodlmth.cache import DEFAULT_MAX_SIZE as DEFAULT_CACHE_SIZE
+from moodlmth.const import (
+    DEDUPE_MIN_SIZE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_TIMEOUT,
+    DEFAULT_WATCH_INTERVAL,
+    Formatter,
+    Syntax,
+)
+from moodlmth.http_cache import DEFAULT_MAX_SIZE
+from moodlmth.limits import Limits
 from moodlmth.protocols import PConverter
+from moodlmth.stats import NULL_STATS, Stats
+
+# Heavy dependencies (requests, black, htmlmin, yaml, htmldoom) are imported
+# only by the code paths that need them, to keep startup fast.
 
 
 def parse_args():
-    parser = ArgumentParser("moodlmth")
-    parser.add_argument("target", help="Target path or URL")
+    parser = ArgumentParser("moodlmth", fromfile_prefix_chars="@")
+    parser.add_argument(
+        "target",
+        nargs="*",
+        help=(
+            "Target path, URL, directory or glob. Use @FILE to read targets from"
+            " a manifest file, one per line"
+        ),
+    )
     parser.add_argument(
         "-s",
         "--syntax",
@@ -21,6 +45,79 @@ def parse_args():
         type=lambda x: Syntax[x],
         default=Syntax.python.name,
     )
+    parser.add_argument(
+        "--formatter",
+        choices=list(Formatter),
+        help="Format the output natively, with black, or natively checked by black",
+        type=lambda x: Formatter[x],
+        default=Formatter.native.name,
+    )
+    parser.add_argument(
+        "--format-cache",
+        metavar="DIR",
+        help="Keep formatted sections in this directory to reuse them across runs",
+    )
+    parser.add_argument(
+        "--format-cache-size",
+        type=int,
+        metavar="MB",
+        help=(
+            "Evict the least recently used sections from the format cache over"
+            f" this size (default: {DEFAULT_CACHE_SIZE // 2 ** 20})"
+        ),
+        default=DEFAULT_CACHE_SIZE // 2 ** 20,
+    )
+    parser.add_argument(
+        "--http-cache",
+        metavar="DIR",
+        help=(
+            "Keep the output of downloaded pages in this directory and reuse it"
+            " while the server answers that the page did not change"
+        ),
+    )
+    parser.add_argument(
+        "--http-cache-size",
+        type=int,
+        metavar="MB",
+        help=(
+            "Evict the least recently used pages from the HTTP cache over this"
+            f" size (default: {DEFAULT_MAX_SIZE // 2 ** 20})"
+        ),
+        default=DEFAULT_MAX_SIZE // 2 ** 20,
+    )
+    parser.add_argument(
+        "--assets",
+        metavar="DIR",
+        help=(
+            "Store the YAML components and raw scripts and styles in this directory,"
+            f" shared by all conversions (default: {DEFAULT_DIRECTORY})"
+        ),
+        default=DEFAULT_DIRECTORY,
+    )
+    parser.add_argument(
+        "--dedupe",
+        type=int,
+        metavar="NODES",
+        help=(
+            "Define repeated subtrees of at least this many nodes once in the"
+            f" Python output, 0 to inline them (default: {DEDUPE_MIN_SIZE})"
+        ),
+        default=DEDUPE_MIN_SIZE,
+    )
+    parser.add_argument(
+        "--static",
+        action="store_true",
+        help="Pre-render the Python output's sections to HTML fragments",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        metavar="NODES",
+        help=(
+            "Split subtrees of more than this many nodes into functions of the"
+            " Python output, to bound the size and nesting of its statements"
+        ),
+    )
     parser.add_argument(
         "-o",
         "--outfile",
@@ -28,11 +125,116 @@ def parse_args():
         help="Destination file path.",
         default=sys.stdout,
     )
+    parser.add_argument(
+        "-d",
+        "--outdir",
+        help="Destination directory for batch conversion of multiple targets",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help=(
+            "Record the content hashes of the converted targets in this file and"
+            " reconvert only the targets that changed since"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        nargs="?",
+        type=float,
+        const=DEFAULT_WATCH_INTERVAL,
+        metavar="SECONDS",
+        help=(
+            "Keep polling the local targets and reconvert them as they change"
+            f" (default: every {DEFAULT_WATCH_INTERVAL} seconds)"
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of worker processes for batch conversion (default: all cores)",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        help=f"Number of parallel downloads (default: {DEFAULT_CONCURRENCY})",
+        default=DEFAULT_CONCURRENCY,
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        help=f"Timeout in seconds for each download (default: {DEFAULT_TIMEOUT})",
+        default=DEFAULT_TIMEOUT,
+    )
     parser.add_argument(
         "-f",
         "--fast",
         action="store_true",
-        help="Force python formatting with black's 'fast' mode",
+        help="Skip black's safety checks when black formats the output",
+    )
+    parser.add_argument(
+        "--htmlmin",
+        action="store_true",
+        help="Collapse whitespace with an htmlmin pre-pass instead of while parsing",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse the input in chunks as it is read instead of loading it whole",
+    )
+    parser.add_argument(
+        "--stats",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="Write timings and counters as JSON to FILE (default: stderr)",
+    )
+    limits = parser.add_argument_group(
+        "limits", "Reject documents going over these limits, unlimited by default"
+    )
+    limits.add_argument(
+        "--max-bytes", type=int, metavar="N", help="Size of the input in bytes"
+    )
+    limits.add_argument(
+        "--max-depth", type=int, metavar="N", help="Nesting depth of the elements"
+    )
+    limits.add_argument(
+        "--max-nodes",
+        type=int,
+        metavar="N",
+        help="Number of elements, texts and comments",
+    )
+    limits.add_argument(
+        "--max-output",
+        type=int,
+        metavar="N",
+        help="Size of the output (and YAML assets) in bytes",
+    )
+    limits.add_argument(
+        "--max-time",
+        type=float,
+        metavar="SECONDS",
+        help="Time spent converting each document",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="ADDRESS",
+        help=(
+            "Keep running and convert the JSON requests received over HTTP on"
+            " HOST:PORT or a Unix socket path, or as JSON lines on stdin for -"
+        ),
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        help=(
+            "Number of documents the server converts at a time"
+            f" (default: {DEFAULT_MAX_IN_FLIGHT})"
+        ),
+        default=DEFAULT_MAX_IN_FLIGHT,
     )
     parser.add_argument("--debug", action="store_true", help="Print debug messages")
     parser.add_argument(
@@ -42,29 +244,273 @@ def parse_args():
     return parser.parse_args()
 
 
-def load_converter(args, logger: logging.Logger) -> PConverter:
+def load_converter(
+    args, logger: logging.Logger, stats: t.Optional[Stats] = None
+) -> PConverter:
+    from moodlmth.cache import shared_cache
+
+    cache = None
+    if args.format_cache:
+        cache = shared_cache(args.format_cache, args.format_cache_size * 2 ** 20)
+    limits = Limits(
+        max_bytes=args.max_bytes,
+        max_depth=args.max_depth,
+        max_nodes=args.max_nodes,
+        max_output=args.max_output,
+        timeout=args.max_time,
+    )
+    options = dict(
+        fast=args.fast,
+        logger=logger,
+        htmlmin=args.htmlmin,
+        formatter=args.formatter,
+        cache=cache,
+        stats=stats,
+        limits=limits if limits.enabled else None,
+    )
     if args.syntax is Syntax.python:
         from moodlmth.py_converter import Converter
 
-        return Converter(fast=args.fast, logger=logger)
+        options["dedupe"] = args.dedupe
+        options["static"] = args.static
+        options["chunk_size"] = args.chunk_size
+    else:
+        from moodlmth.yaml_converter import Converter
+
+        options["assets"] = args.assets
+
+    return Converter(**options)
+
+
+def cache_settings(args) -> str:
+    """Identifies the options the output of a conversion depends on."""
+    settings = [__version__, args.syntax.name, args.fast, args.formatter.name]
+    settings += [args.htmlmin, args.dedupe, args.static, args.chunk_size]
+    if args.syntax is Syntax.yaml:
+        settings.append(args.assets)
+    return repr(settings)
+
+
+def load_http_cache(args) -> t.Any:
+    return _http_cache(args.http_cache, args.http_cache_size * 2 ** 20)
+
+
+@lru_cache(maxsize=None)
+def _http_cache(directory: str, max_size: int) -> t.Any:
+    # One per process, so the size of the directory is only scanned once and
+    # then tracked as the jobs of a batch store their pages.
+    from moodlmth.http_cache import HTTPCache
+
+    return HTTPCache(directory, max_size=max_size)
+
+
+def write_stats(stats: Stats, target: str) -> None:
+    import json
+
+    data = json.dumps(stats.asdict(), indent=2, sort_keys=True)
+    if target == "-":
+        print(data, file=sys.stderr)
+        return
+    with open(target, "w") as f:
+        print(data, file=f)
+
+
+def convert_jobs(
+    args, jobs, manifest=None, stats: t.Optional[Stats] = None, executor=None
+) -> int:
+    """Converts the jobs, reporting each of them, and returns how many failed."""
+    from moodlmth import batch
+
+    failed = 0
+    try:
+        for result in batch.run(
+            jobs, options=args, workers=args.jobs, executor=executor
+        ):
+            if manifest is not None:
+                manifest.record(result)
+            if stats is not None and result.stats:
+                stats.merge(result.stats)
+            if result.ok:
+                print(f"{result.source} -> {result.destination}", file=sys.stderr)
+                continue
+            failed += 1
+            print(f"Failed: {result.source}: {result.error}", file=sys.stderr)
+    finally:
+        if manifest is not None:
+            manifest.save()
+    return failed
+
+
+def watch(args, manifest, executor) -> None:
+    import time
+
+    from moodlmth import batch
+
+    print(
+        f"Watching for changes every {args.watch}s, press Ctrl-C to stop",
+        file=sys.stderr,
+    )
+    try:
+        while True:
+            time.sleep(args.watch)
+            # Targets are expanded again to pick up new files. Only the inputs
+            # whose size or modification time changed are read.
+            jobs = batch.plan_jobs(args.target, args.outdir)
+            stale = manifest.stale(j for j in jobs if not batch.is_url(j.source))
+            if not stale:
+                continue
+            failed = convert_jobs(args, stale, manifest, executor=executor)
+            print(
+                f"Rebuilt {len(stale) - failed}/{len(stale)} targets", file=sys.stderr
+            )
+    except KeyboardInterrupt:
+        pass
+
+
+def run_batch(args) -> None:
+    from concurrent.futures import ProcessPoolExecutor
+    from contextlib import ExitStack
+
+    from moodlmth import batch
+
+    jobs = batch.plan_jobs(args.target, args.outdir)
+    if not jobs:
+        raise ValueError("No targets found")
 
-    from moodlmth.yaml_converter import Converter
+    manifest = None
+    if args.manifest or args.watch:
+        from moodlmth.manifest import Manifest
 
-    return Converter(fast=args.fast, logger=logger)
+        manifest = Manifest(args.manifest, cache_settings(args))
+    stale = jobs if manifest is None else manifest.stale(jobs)
+
+    stats = Stats()
+    with ExitStack() as stack:
+        executor = None
+        if args.watch:
+            # The workers stay warm between rebuilds.
+            workers = args.jobs or batch.available_cpus()
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+        failed = convert_jobs(args, stale, manifest, stats, executor)
+
+        summary = f"Converted {len(stale) - failed}/{len(stale)} targets"
+        if len(stale) < len(jobs):
+            summary += f", {len(jobs) - len(stale)} up to date"
+        print(summary, file=sys.stderr)
+        if args.stats:
+            stats.count("targets", len(jobs))
+            stats.count("up_to_date", len(jobs) - len(stale))
+            stats.count("failed", failed)
+            write_stats(stats, args.stats)
+        if args.watch:
+            watch(args, manifest, executor)
+            return
+    if failed:
+        sys.exit(1)
+
+
+def run_server(args) -> None:
+    from argparse import Namespace
+
+    from moodlmth.server import DEFAULT_MAX_BODY, Service, serve
+
+    logger = logging.getLogger(__name__)
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    def factory(syntax: Syntax, fast: bool) -> PConverter:
+        options = Namespace(**{**vars(args), "syntax": syntax, "fast": fast})
+        return load_converter(options, logger=logger)
+
+    service = Service(
+        factory,
+        max_in_flight=args.max_in_flight,
+        timeout=args.timeout,
+        logger=logger,
+        # Bodies over the input limit are rejected before they are read.
+        max_body=args.max_bytes or DEFAULT_MAX_BODY,
+    )
+    if args.serve != "-":
+        print(f"Serving on {args.serve}", file=sys.stderr)
+    try:
+        serve(service, args.serve)
+    finally:
+        service.close()
+
+
+def convert_stream(args, stats: t.Optional[Stats] = None) -> None:
+    logger = logging.getLogger(__name__)
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    converter = load_converter(args, logger=logger, stats=stats)
+    if args.target.startswith("http://") or args.target.startswith("https://"):
+        from moodlmth.fetch import Fetcher
+
+        with Fetcher(timeout=args.timeout) as fetcher:
+            with fetcher.stream(args.target) as (chunks, encoding):
+                converter.convert_stream_to(chunks, args.outfile, encoding=encoding)
+                return
+
+    if not os.path.exists(args.target):
+        raise ArgumentError(None, f"Invalid target: {args.target}")
+    converter.convert_stream_to(iter_file(args.target), args.outfile)
 
 
 def main():
     args = parse_args()
+    if args.serve:
+        run_server(args)
+        return
+    if not args.target:
+        raise ArgumentError(None, "A target is required unless --serve is used")
+
+    batched = args.outdir or args.manifest or args.watch
+    if batched or len(args.target) > 1 or os.path.isdir(args.target[0]):
+        if args.outdir is None:
+            raise ArgumentError(
+                None,
+                "--outdir is required for multiple targets, --manifest and --watch",
+            )
+        args.outfile = None
+        run_batch(args)
+        return
+
+    args.target = args.target[0]
+    stats = Stats() if args.stats else NULL_STATS
+    if args.stream:
+        convert_stream(args, stats=stats)
+        print(file=args.outfile)
+        if args.stats:
+            write_stats(stats, args.stats)
+        return
+
     content = ""
+    page = None
     if args.target.startswith("http://") or args.target.startswith("https://"):
-        resp = requests.get(args.target)
-        resp.raise_for_status()
-        content = resp.text
+        from moodlmth.fetch import Fetcher
+
+        with stats.phase("fetch"), Fetcher(timeout=args.timeout) as fetcher:
+            if args.http_cache:
+                page = load_http_cache(args).revalidate(
+                    fetcher, args.target, cache_settings(args)
+                )
+                content = page.content
+            else:
+                content = fetcher.get(args.target)
+
+        if page and page.output is not None:
+            # Not modified since it was converted.
+            stats.count("http_cache_hits")
+            print(page.output, file=args.outfile)
+            if args.stats:
+                write_stats(stats, args.stats)
+            return
     elif os.path.exists(args.target):
-        with open(args.target) as f:
+        with stats.phase("read"), open(args.target) as f:
             content = f.read()
     else:
-        raise ArgumentError(f"Invalid target: {args.target}")
+        raise ArgumentError(None, f"Invalid target: {args.target}")
 
     if not content:
         raise ValueError("No content found")
@@ -73,9 +519,18 @@ def main():
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
-    converter = load_converter(args, logger=logger)
-    result = converter.convert(content)
-    print(result, file=args.outfile)
+    converter = load_converter(args, logger=logger, stats=stats)
+    if page:
+        # The output is kept whole for the HTTP cache.
+        result = converter.convert(content)
+        load_http_cache(args).store(args.target, cache_settings(args), page, result)
+        print(result, file=args.outfile)
+    else:
+        # Written section by section, without holding the whole output.
+        converter.convert_to(content, args.outfile)
+        print(file=args.outfile)
+    if args.stats:
+        write_stats(stats, args.stats)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,26 @@
 from enum import Enum
 
+LINE_LENGTH = 79
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_WATCH_INTERVAL = 1.0
+
+# Smallest repeated subtree, in nodes, moved to a shared definition.
+DEDUPE_MIN_SIZE = 4
+
 
 class Syntax(Enum):
     python = "Python"
     yaml = "YAML"
 
 
+class Formatter(Enum):
+    native = "Native"
+    black = "Black"
+    verify = "Verify"
+
+
 LEAF_TAGS = {
     "area",
     "base",
@@ -23,3 +38,6 @@ LEAF_TAGS = {
     "track",
     "wbr",
 }
+
+# Tags whose text content keeps its whitespace.
+PRE_TAGS = {"pre", "textarea", "script", "style"}
@@ -0,0 +1,62 @@
+"Collects the problems found in a document and reports them once."
+
+import logging
+import typing as t
+import warnings
+from collections import Counter
+
+# Kinds of problems, with the title they are reported under. Renamed attributes
+# are expected (e.g. class -> class_) and only logged at the debug level.
+WARNINGS = {
+    "unknown tag": "Tags not found in htmldoom",
+    "mismatched end tag": "End tags closing another tag",
+    "unclosed tag": "Tags never closed",
+}
+NOTES = {"renamed attribute": "Attributes renamed after python keywords"}
+
+
+class Diagnostics:
+    """Counts problems by kind and subject, e.g. ("unknown tag", "x-card").
+
+    Example:
+
+        >>> converter = Converter()
+        >>> converter.convert("<html><body><x-card></x-card></body></html>")
+        >>> converter.diagnostics.summary()
+        {'unknown tag': {'x-card': 1}}
+    """
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self.counts: t.Counter[t.Tuple[str, str]] = Counter()
+
+    def add(self, kind: str, subject: str) -> None:
+        self.counts[kind, subject] += 1
+
+    def summary(self) -> t.Dict[str, t.Dict[str, int]]:
+        summary: t.Dict[str, t.Dict[str, int]] = {}
+        for (kind, subject), count in self.counts.items():
+            summary.setdefault(kind, {})[subject] = count
+        return summary
+
+    def report(self, logger: logging.Logger) -> None:
+        """Warns once per kind of problem found."""
+        for kind, subjects in self.summary().items():
+            found = ", ".join(f"{subject} ({n})" for subject, n in subjects.items())
+            if kind in WARNINGS:
+                warnings.warn(f"{WARNINGS[kind]}: {found}", Warning)
+            else:
+                logger.debug("%s: %s", NOTES.get(kind, kind), found)
+
+
+class NullDiagnostics(Diagnostics):
+    """Diagnostics that collect nothing, used when they are disabled."""
+
+    enabled = False
+
+    def add(self, kind: str, subject: str) -> None:
+        pass
+
+
+NULL_DIAGNOSTICS = NullDiagnostics()
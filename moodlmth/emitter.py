@@ -0,0 +1,419 @@
+"""Formats generated code the way black does, without running black.
+
+The generated modules only use a small part of the Python syntax: names,
+attribute access, string literals, calls, keyword arguments and dicts. For
+that subset this module follows black's line splitting rules (right hand
+split with trailer omission, one item per line with a trailing comma when a
+bracket's contents still don't fit, exploded dict literals) and its string
+quote normalization, so the output is what `black.format_file_contents`
+would produce.
+"""
+
+import functools
+import logging
+import re
+import typing as t
+
+from moodlmth.const import LINE_LENGTH, Formatter
+
+OPENING_BRACKETS = {"(", "[", "{"}
+CLOSING_BRACKETS = {")", "]", "}"}
+COLLECTION_BRACKETS = {"[", "{"}
+
+TOKENS = re.compile(
+    r"""
+    (?P<string>[bB]?(?:'[^'\\\n]*(?:\\.[^'\\\n]*)*'|"[^"\\\n]*(?:\\.[^"\\\n]*)*"))
+    |(?P<name>[A-Za-z_][A-Za-z0-9_]*|[0-9]+)
+    |(?P<op>[()\[\]{}.,:=@])
+    |(?P<space>\s+)
+    """,
+    re.VERBOSE,
+)
+
+
+class CannotSplit(Exception):
+    pass
+
+
+class Leaf:
+    __slots__ = ("kind", "value", "prefix", "pos", "opening_bracket", "closing_bracket")
+
+    def __init__(
+        self, kind: str, value: str, prefix: str = "", pos: t.Optional[int] = None
+    ) -> None:
+        self.kind = kind
+        self.value = value
+        self.prefix = prefix
+        # Position in the tokenized statement. Every line is a contiguous run of
+        # the statement's leaves (plus maybe an added trailing comma), so the
+        # distance between two positions is also the distance within a line.
+        self.pos = pos
+        self.opening_bracket: t.Optional["Leaf"] = None
+        self.closing_bracket: t.Optional["Leaf"] = None
+
+
+class Line:
+    __slots__ = ("depth", "leaves", "inside_brackets")
+
+    def __init__(
+        self,
+        depth: int = 0,
+        leaves: t.Optional[t.List[Leaf]] = None,
+        inside_brackets: bool = False,
+    ) -> None:
+        self.depth = depth
+        self.leaves = leaves if leaves is not None else []
+        self.inside_brackets = inside_brackets
+
+    def lengths(self, reverse: bool = False) -> t.Iterator[t.Tuple[int, Leaf, int]]:
+        """Yields (index, leaf, length) with the whitespace before each leaf."""
+        indexes = range(len(self.leaves))
+        for i in reversed(indexes) if reverse else indexes:
+            leaf = self.leaves[i]
+            yield i, leaf, len(leaf.value) + (len(leaf.prefix) if i else 0)
+
+    def comma_delimiters(self) -> t.List[int]:
+        """Indexes of the commas outside of any bracket.
+
+        Bracketed groups are jumped over, so this only costs as much as the
+        number of top level items.
+        """
+        commas, i, n = [], 0, len(self.leaves)
+        while i < n:
+            leaf = self.leaves[i]
+            if leaf.kind in OPENING_BRACKETS and leaf.closing_bracket:
+                i += leaf.closing_bracket.pos - leaf.pos
+            elif leaf.kind == ",":
+                commas.append(i)
+            i += 1
+        return commas
+
+    def __str__(self) -> str:
+        if not self.leaves:
+            return ""
+        first, *rest = self.leaves
+        code = "".join(f"{leaf.prefix}{leaf.value}" for leaf in rest)
+        return f"{'    ' * self.depth}{first.value}{code}"
+
+
+def normalize_string_quotes(value: str) -> str:
+    """Prefers double quotes unless that needs more escaping, like black."""
+    prefix_end = 0
+    while value[prefix_end] not in "'\"":
+        prefix_end += 1
+    prefix = value[:prefix_end].lower()
+    if value[prefix_end] == '"':
+        orig_quote, new_quote = '"', "'"
+    else:
+        orig_quote, new_quote = "'", '"'
+
+    unescaped_new_quote = re.compile(rf"(([^\\]|^)(\\\\)*){new_quote}")
+    escaped_new_quote = re.compile(rf"([^\\]|^)\\((?:\\\\)*){new_quote}")
+    escaped_orig_quote = re.compile(rf"([^\\]|^)\\((?:\\\\)*){orig_quote}")
+
+    body = value[prefix_end + 1 : -1]
+    new_body = _sub_twice(escaped_new_quote, rf"\1\2{new_quote}", body)
+    if body != new_body:
+        # Consider the string without unnecessary escapes as the original.
+        body = new_body
+        value = f"{prefix}{orig_quote}{body}{orig_quote}"
+    new_body = _sub_twice(escaped_orig_quote, rf"\1\2{orig_quote}", new_body)
+    new_body = _sub_twice(unescaped_new_quote, rf"\1\\{new_quote}", new_body)
+
+    orig_escape_count = body.count("\\")
+    new_escape_count = new_body.count("\\")
+    if new_escape_count > orig_escape_count:
+        return f"{prefix}{value[prefix_end:]}"
+    if new_escape_count == orig_escape_count and orig_quote == '"':
+        return f"{prefix}{value[prefix_end:]}"
+    return f"{prefix}{new_quote}{new_body}{new_quote}"
+
+
+def _sub_twice(regex: t.Pattern, replacement: str, original: str) -> str:
+    # Matches may overlap, so a single pass can miss some of them.
+    return regex.sub(replacement, regex.sub(replacement, original))
+
+
+def tokenize(source: str) -> t.List[Leaf]:
+    """Splits one logical line of generated code into leaves.
+
+    The whitespace before each leaf follows black: one space after commas and
+    colons, around assignments and between words, none anywhere else.
+    """
+    leaves: t.List[Leaf] = []
+    brackets: t.List[Leaf] = []
+    pos = 0
+    while pos < len(source):
+        match = TOKENS.match(source, pos)
+        if not match:
+            raise ValueError(f"Can't tokenize: {source[pos : pos + 20]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+
+        value = match.group()
+        if kind == "op":
+            kind = value
+        elif kind == "string":
+            value = normalize_string_quotes(value)
+
+        prev = leaves[-1] if leaves else None
+        prefix = ""
+        if prev is None or kind in CLOSING_BRACKETS:
+            pass
+        elif prev.kind in {",", ":"}:
+            prefix = " "
+        elif kind == "=" and not brackets:
+            prefix = " "
+        elif prev.kind == "=" and not brackets:
+            prefix = " "
+        elif prev.kind == "name" and kind in {"name", "string", "{", "["}:
+            prefix = " "
+
+        leaf = Leaf(kind, value, prefix, pos=len(leaves))
+        if kind in OPENING_BRACKETS:
+            brackets.append(leaf)
+        elif kind in CLOSING_BRACKETS:
+            leaf.opening_bracket = brackets.pop()
+            leaf.opening_bracket.closing_bracket = leaf
+        leaves.append(leaf)
+    return leaves
+
+
+def is_line_short_enough(line: Line, line_length: int) -> bool:
+    length = 4 * line.depth
+    for _, _, leaf_length in line.lengths():
+        length += leaf_length
+        if length > line_length:
+            return False
+    return True
+
+
+def should_explode(line: Line, opening_bracket: Leaf) -> bool:
+    """Collections that need splitting get one item per line."""
+    if opening_bracket.kind not in COLLECTION_BRACKETS:
+        return False
+    commas = line.comma_delimiters()
+    if commas and commas[-1] == len(line.leaves) - 1:
+        commas.pop()
+    return bool(commas)
+
+
+def delimiter_split(line: Line) -> t.Iterator[Line]:
+    """Splits a bracket's contents into one item per line."""
+    commas = line.comma_delimiters()
+    if not commas:
+        raise CannotSplit("No delimiters found")
+
+    start = 0
+    for comma in commas:
+        yield Line(line.depth, line.leaves[start : comma + 1], line.inside_brackets)
+        start = comma + 1
+    if start < len(line.leaves):
+        rest = line.leaves[start:] + [Leaf(",", ",")]
+        yield Line(line.depth, rest, line.inside_brackets)
+
+
+def right_hand_split(
+    line: Line, omit: t.Collection[int] = ()
+) -> t.Iterator[t.Tuple[Line, bool]]:
+    """Splits the line at its last opening bracket not in `omit`.
+
+    Yields (line, should_explode) for the head, the body and the tail. Like
+    black, empty brackets stay on the tail and the search goes on before them.
+    """
+    leaves = line.leaves
+    i = len(leaves) - 1
+    while True:
+        while i >= 0 and (
+            leaves[i].kind not in CLOSING_BRACKETS or id(leaves[i]) in omit
+        ):
+            i -= 1
+        if i < 0:
+            raise CannotSplit("No brackets found")
+
+        closing_bracket = leaves[i]
+        opening_bracket = closing_bracket.opening_bracket
+        j = i - (closing_bracket.pos - opening_bracket.pos)
+        if j < 0:
+            raise CannotSplit("No brackets found")
+        if j < i - 1:
+            break
+        i = j - 1
+
+    body_line = Line(line.depth + 1, leaves[j + 1 : i], inside_brackets=True)
+    yield Line(line.depth, leaves[: j + 1]), False
+    yield body_line, should_explode(body_line, opening_bracket)
+    yield Line(line.depth, leaves[i:]), False
+
+
+def generate_trailers_to_omit(line: Line, line_length: int) -> t.Iterator[t.Set[int]]:
+    """Yields growing sets of trailing brackets to leave on the tail line."""
+    omit: t.Set[int] = set()
+    yield omit
+
+    length = 4 * line.depth
+    opening_bracket: t.Optional[Leaf] = None
+    closing_bracket: t.Optional[Leaf] = None
+    inner_brackets: t.Set[int] = set()
+    for index, leaf, leaf_length in line.lengths(reverse=True):
+        length += leaf_length
+        if length > line_length:
+            break
+
+        if opening_bracket:
+            if leaf is opening_bracket:
+                opening_bracket = None
+            elif leaf.kind in CLOSING_BRACKETS:
+                inner_brackets.add(id(leaf))
+        elif leaf.kind in CLOSING_BRACKETS:
+            if index > 0 and line.leaves[index - 1].kind in OPENING_BRACKETS:
+                inner_brackets.add(id(leaf))
+                continue
+            if closing_bracket:
+                omit.add(id(closing_bracket))
+                omit.update(inner_brackets)
+                inner_brackets.clear()
+                yield set(omit)
+            opening_bracket = leaf.opening_bracket
+            closing_bracket = leaf
+
+
+def rhs(line: Line, line_length: int) -> t.Iterator[t.Tuple[Line, bool]]:
+    for omit in generate_trailers_to_omit(line, line_length):
+        lines = list(right_hand_split(line, omit=omit))
+        if is_line_short_enough(lines[0][0], line_length):
+            yield from lines
+            return
+
+    # All splits failed or the line is too short.
+    yield from right_hand_split(line)
+
+
+def split_line(line: Line, line_length: int) -> t.Iterator[Line]:
+    """Splits the line until every part fits, or can't be split any further.
+
+    Parts still to be split are kept on an explicit stack rather than being
+    recursed into, so deeply nested code doesn't exhaust the Python stack.
+    """
+    stack = [(line, False)]
+    while stack:
+        line, explode = stack.pop()
+        if not explode and is_line_short_enough(line, line_length):
+            yield line
+            continue
+
+        transforms = [lambda line: rhs(line, line_length)]
+        if line.inside_brackets:
+            transforms.insert(
+                0, lambda line: ((part, False) for part in delimiter_split(line))
+            )
+
+        for transform in transforms:
+            try:
+                parts = list(transform(line))
+            except CannotSplit:
+                continue
+            if any(_unchanged(part, line) for part, _ in parts):
+                continue
+            stack.extend(reversed(parts))
+            break
+        else:
+            yield line
+
+
+def _unchanged(part: Line, line: Line) -> bool:
+    # Parts are made of the line's own leaves (plus maybe a trailing comma), so
+    # the same depth and number of leaves means the same line.
+    return part.depth == line.depth and len(part.leaves) == len(line.leaves)
+
+
+def format_line(source: str, depth: int = 0, line_length: int = LINE_LENGTH) -> str:
+    """Formats one logical line of generated code.
+
+    source: The code on a single line, e.g. `@renders(e.p()('Hello'))`.
+    depth: Indentation level of the statement.
+    line_length: Maximum line length, as in black's FileMode.
+    """
+    line = Line(depth, tokenize(source))
+    return "\n".join(str(part) for part in split_line(line, line_length))
+
+
+@functools.lru_cache(maxsize=None)
+def black_file_mode(line_length: int = LINE_LENGTH) -> t.Any:
+    """The black.FileMode the generated code follows, built once per process."""
+    import black
+
+    return black.FileMode(
+        target_versions={},
+        is_pyi=False,
+        line_length=line_length,
+        string_normalization=True,
+    )
+
+
+def format_with_black(source: str, fast: bool, mode: t.Any) -> str:
+    import black
+
+    try:
+        return black.format_file_contents(source, fast=fast, mode=mode)
+    except black.NothingChanged:
+        return source
+
+
+def format_line_with_black(source: str, depth: int, fast: bool, mode: t.Any) -> str:
+    """Formats one logical line with black.
+
+    A decorator gets a stub function to decorate and an indented statement a
+    stub function to live in, so only depths 0 and 1 are supported.
+    """
+    header = "def _():\n" if depth else ""
+    footer = "\ndef _():\n    pass" if source.startswith("@") else ""
+    code = f"{header}{'    ' * depth}{source}{footer}\n"
+    lines = format_with_black(code, fast=fast, mode=mode).splitlines()
+    if header:
+        lines = lines[1:]
+    if footer:
+        lines = lines[:-2]
+    return "\n".join(lines)
+
+
+def format_statement(
+    source: str,
+    formatter: Formatter,
+    fast: bool,
+    mode: t.Any = None,
+    depth: int = 0,
+    cache: t.Any = None,
+) -> str:
+    """Formats one logical line with the chosen formatter.
+
+    With a `moodlmth.cache.FormatCache`, a line that has been formatted before
+    with the same settings is reused instead. black is only imported when it
+    formats the line, `mode` defaults to `black_file_mode()`.
+    """
+    if formatter is Formatter.black:
+        mode = mode if mode is not None else black_file_mode()
+        settings = repr(mode)
+        format_ = lambda: format_line_with_black(source, depth, fast=fast, mode=mode)
+    else:
+        line_length = mode.line_length if mode is not None else LINE_LENGTH
+        settings = str(line_length)
+        format_ = lambda: format_line(source, depth, line_length=line_length)
+
+    if cache is None:
+        return format_()
+
+    key = cache.key(formatter.name, str(fast), settings, str(depth), source)
+    return cache.get_or_format(key, format_)
+
+
+def verify_with_black(
+    source: str, fast: bool, mode: t.Any, logger: logging.Logger
+) -> str:
+    """Checks natively formatted code against black, falling back to its output."""
+    result = format_with_black(source, fast=fast, mode=mode)
+    if result != source:
+        logger.warning("Native formatting differs from black, using black's output")
+    return result
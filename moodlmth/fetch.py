@@ -0,0 +1,105 @@
+"Fetches documents over HTTP."
+
+import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from moodlmth.base import CHUNK_SIZE
+from moodlmth.const import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+
+
+class Fetcher:
+    """Downloads pages over a shared session with keep-alive connections.
+
+    Example:
+
+        >>> fetcher = Fetcher(concurrency=16, timeout=10)
+        >>> for url, content, error in fetcher.fetch_many(urls):
+        ...     print(url, error or len(content))
+    """
+
+    def __init__(
+        self, concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT
+    ) -> None:
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        # Keep up to `concurrency` open connections per host so that parallel
+        # requests to the same site reuse them instead of reconnecting.
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url: str) -> str:
+        resp = self.session.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.text
+
+    def get_if_modified(
+        self,
+        url: str,
+        etag: t.Optional[str] = None,
+        last_modified: t.Optional[str] = None,
+    ) -> t.Tuple[t.Optional[str], t.Optional[str], t.Optional[str]]:
+        """Downloads the page unless it did not change since a previous download.
+
+        Sends the ETag and Last-Modified of the previous response as
+        conditional request headers. Returns the content (None when the server
+        answers 304 Not Modified), and the page's ETag and Last-Modified.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        resp = self.session.get(url, timeout=self.timeout, headers=headers)
+        if resp.status_code == 304 and headers:
+            return (
+                None,
+                resp.headers.get("ETag", etag),
+                resp.headers.get("Last-Modified", last_modified),
+            )
+        resp.raise_for_status()
+        return resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+
+    @contextmanager
+    def stream(self, url: str) -> t.Iterator[t.Tuple[t.Iterator[bytes], str]]:
+        """Yields the body as an iterator of byte chunks and its encoding.
+
+        The body is read from the socket as the chunks are consumed.
+        """
+        with self.session.get(url, timeout=self.timeout, stream=True) as resp:
+            resp.raise_for_status()
+            yield resp.iter_content(CHUNK_SIZE), resp.encoding or "utf-8"
+
+    def fetch_many(
+        self, urls: t.Iterable[str], get: t.Optional[t.Callable[[str], t.Any]] = None
+    ) -> t.Iterator[t.Tuple[str, t.Any, t.Optional[str]]]:
+        """Yields (url, content, error) tuples in the order the downloads finish.
+
+        A failed download is reported through `error` instead of raising, so
+        the remaining pages are still fetched. `get` replaces `self.get` to
+        download each page, e.g. to revalidate it with an HTTPCache.
+        """
+        get = get or self.get
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(get, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    yield url, future.result(), None
+                except requests.RequestException as e:
+                    yield url, None, f"{type(e).__name__}: {e}"
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "Fetcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,95 @@
+"Reuses the output of pages that did not change since they were converted."
+
+import hashlib
+import json
+import os
+import tempfile
+import typing as t
+from dataclasses import asdict, dataclass
+
+from moodlmth.cache import BoundedDirectory
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+@dataclass
+class CachedOutput:
+    url: str
+    etag: t.Optional[str]
+    last_modified: t.Optional[str]
+    output: str
+
+
+@dataclass
+class Revalidated:
+    """A page as revalidated: either the still current `output`, or its new
+    `content` with its validators."""
+
+    output: t.Optional[str] = None
+    content: t.Optional[str] = None
+    etag: t.Optional[str] = None
+    last_modified: t.Optional[str] = None
+
+
+class HTTPCache:
+    """A directory of converted pages with their ETag and Last-Modified.
+
+    Pages are revalidated with a conditional request, and when the server
+    answers 304 Not Modified the output of the previous conversion is reused
+    as is. Entries are keyed by URL and conversion settings, and the least
+    recently used ones are evicted once the directory grows over `max_size`
+    bytes. Several processes may share one directory.
+
+    Example:
+
+        >>> cache = HTTPCache(".moodlmth-http")
+        >>> page = cache.revalidate(fetcher, url, settings)
+        >>> output = page.output or converter.convert(page.content)
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = directory
+        self._disk = BoundedDirectory(directory, ".json", max_size)
+
+    def _path(self, url: str, settings: str) -> str:
+        digest = hashlib.sha256(f"{url}\0{settings}".encode("utf-8", "surrogatepass"))
+        key = digest.hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, url: str, settings: str) -> t.Optional[CachedOutput]:
+        path = self._path(url, settings)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = CachedOutput(**json.load(f))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+        BoundedDirectory.touch(path)
+        return entry
+
+    def put(self, settings: str, entry: CachedOutput) -> None:
+        path = self._path(entry.url, settings)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(asdict(entry), f)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        self._disk.added(size)
+
+    def revalidate(self, fetcher: t.Any, url: str, settings: str) -> Revalidated:
+        """Downloads the page unless the cached output is still current."""
+        entry = self.get(url, settings)
+        if entry is None:
+            content, etag, last_modified = fetcher.get_if_modified(url)
+        else:
+            content, etag, last_modified = fetcher.get_if_modified(
+                url, etag=entry.etag, last_modified=entry.last_modified
+            )
+            if content is None:
+                return Revalidated(output=entry.output)
+        return Revalidated(content=content, etag=etag, last_modified=last_modified)
+
+    def store(self, url: str, settings: str, page: Revalidated, output: str) -> None:
+        """Keeps the output of a downloaded page, if it can be revalidated."""
+        if page.etag or page.last_modified:
+            self.put(settings, CachedOutput(url, page.etag, page.last_modified, output))
@@ -0,0 +1,69 @@
+"Bounds the resources a single conversion may use."
+
+import typing as t
+from dataclasses import dataclass
+
+# Nodes parsed between two looks at the clock.
+CLOCK_INTERVAL = 256
+
+
+class LimitExceeded(ValueError):
+    """Raised as soon as a document goes over one of its Limits."""
+
+    def __init__(self, limit: str, maximum: t.Union[int, float]) -> None:
+        super().__init__(f"Document exceeds {limit} limit of {maximum}")
+        self.limit = limit
+        self.maximum = maximum
+
+
+@dataclass(frozen=True)
+class Limits:
+    """Limits on a single conversion, each disabled when None.
+
+    max_bytes: Size of the input, in bytes once encoded as UTF-8.
+    max_depth: Nesting depth of the elements.
+    max_nodes: Number of elements, texts and comments.
+    max_output: Size of the generated code (and YAML assets), in bytes once
+        encoded as UTF-8.
+    timeout: Wall-clock seconds from the start of the conversion.
+
+    The converters check them while the input is fed and parsed, so a bad
+    document is rejected before the render and format stages.
+
+    Example:
+
+        >>> converter = Converter(limits=Limits(max_bytes=10_000_000, timeout=30))
+    """
+
+    max_bytes: t.Optional[int] = None
+    max_depth: t.Optional[int] = None
+    max_nodes: t.Optional[int] = None
+    max_output: t.Optional[int] = None
+    timeout: t.Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return any(
+            limit is not None
+            for limit in (
+                self.max_bytes,
+                self.max_depth,
+                self.max_nodes,
+                self.max_output,
+                self.timeout,
+            )
+        )
+
+
+NO_LIMITS = Limits()
+
+
+def utf8_size(text: str, maximum: t.Optional[int] = None) -> int:
+    """The UTF-8 size of text.
+
+    Text longer than `maximum` characters is over it whatever its encoding,
+    so its length is returned without encoding it.
+    """
+    if maximum is not None and len(text) > maximum:
+        return len(text)
+    return len(text.encode("utf-8", "replace"))
@@ -0,0 +1,118 @@
+"Remembers which inputs were converted, to reconvert only those that changed."
+
+import hashlib
+import json
+import os
+import tempfile
+import typing as t
+from dataclasses import asdict, dataclass
+
+from moodlmth.batch import Job, Result, is_url
+
+
+@dataclass
+class Entry:
+    destination: str
+    digest: str
+    size: int
+    mtime: int
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """The content hashes of the inputs of the last successful conversions.
+
+    A job is up to date while its destination exists and its input has the
+    recorded content hash, under the same `settings` (moodlmth version, syntax,
+    fast, ...) as the whole manifest. Inputs whose size and modification time
+    did not change are not even read, so checking a tree costs one stat per
+    file. URLs are always reconverted. Without a `path` the manifest is kept
+    in memory only.
+
+    Example:
+
+        >>> manifest = Manifest("out/.moodlmth-manifest.json", settings)
+        >>> for result in run(manifest.stale(jobs), options):
+        ...     manifest.record(result)
+        >>> manifest.save()
+    """
+
+    def __init__(self, path: t.Optional[str], settings: str) -> None:
+        self.path = path
+        self.settings = settings
+        self.entries: t.Dict[str, Entry] = {}
+        self._pending: t.Dict[str, Entry] = {}
+        self._changed = False
+
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("settings") == settings:
+                self.entries = {
+                    source: Entry(**entry) for source, entry in data["files"].items()
+                }
+        except (ValueError, TypeError, KeyError, AttributeError):
+            # Unreadable, everything is reconverted and the manifest rewritten.
+            pass
+
+    def is_fresh(self, job: Job) -> bool:
+        if is_url(job.source):
+            return False
+        try:
+            st = os.stat(job.source)
+        except OSError:
+            # Left to the conversion to report.
+            return False
+
+        entry = self.entries.get(job.source)
+        if entry is None or entry.destination != job.destination:
+            entry = None
+        elif not os.path.exists(job.destination):
+            entry = None
+        elif (entry.size, entry.mtime) == (st.st_size, st.st_mtime_ns):
+            return True
+
+        digest = file_digest(job.source)
+        current = Entry(job.destination, digest, st.st_size, st.st_mtime_ns)
+        if entry is not None and entry.digest == digest:
+            # Touched but not modified, remember the new time to skip the hash.
+            self.entries[job.source] = current
+            self._changed = True
+            return True
+        self._pending[job.source] = current
+        return False
+
+    def stale(self, jobs: t.Iterable[Job]) -> t.List[Job]:
+        """The jobs whose input, destination or settings changed."""
+        return [job for job in jobs if not self.is_fresh(job)]
+
+    def record(self, result: Result) -> None:
+        """Marks the input of a successful conversion as up to date."""
+        entry = self._pending.pop(result.source, None)
+        if entry is not None and result.ok:
+            self.entries[result.source] = entry
+            self._changed = True
+
+    def save(self) -> None:
+        if self.path is None or not self._changed:
+            return
+        data = {
+            "settings": self.settings,
+            "files": {source: asdict(entry) for source, entry in self.entries.items()},
+        }
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self._changed = False
@@ -0,0 +1,79 @@
+"Keeps converters ready for reuse."
+
+import queue
+import threading
+import typing as t
+from contextlib import contextmanager
+
+from moodlmth.protocols import PConverter
+
+DEFAULT_SIZE = 8
+
+
+class ConverterPool:
+    """A thread-safe pool of reusable converters.
+
+    Converters are created on demand, up to `size`, and handed back reset
+    after each use. When all of them are busy, callers wait for one to be
+    released (raising queue.Empty once `timeout` seconds have passed).
+
+    Example:
+
+        >>> pool = ConverterPool(lambda: Converter(cache=shared_cache()))
+        >>> pool.convert("<html><body>Hello</body></html>")
+    """
+
+    def __init__(
+        self,
+        factory: t.Callable[[], PConverter],
+        size: int = DEFAULT_SIZE,
+        timeout: t.Optional[float] = None,
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1: {size}")
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[PConverter]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> PConverter:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get(timeout=self.timeout)
+
+        try:
+            return self.factory()
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def converter(self) -> t.Iterator[PConverter]:
+        """Borrows a converter for the duration of the block."""
+        converter = self._acquire()
+        try:
+            yield converter
+        finally:
+            converter.reset()
+            self._idle.put(converter)
+
+    def convert(self, raw_html: str) -> str:
+        with self.converter() as converter:
+            return converter.convert(raw_html)
+
+    def convert_stream(
+        self, chunks: t.Iterable[t.Union[bytes, str]], encoding: str = "utf-8"
+    ) -> str:
+        with self.converter() as converter:
+            return converter.convert_stream(chunks, encoding=encoding)
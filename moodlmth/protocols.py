@@ -1,6 +1,27 @@
+import typing as t
+
 from typing_extensions import Protocol
 
 
 class PConverter(Protocol):
+    def reset(self) -> None:
+        pass
+
     def convert(self, raw_html: str) -> str:
         pass
+
+    def convert_stream(
+        self, chunks: t.Iterable[t.Union[bytes, str]], encoding: str = "utf-8"
+    ) -> str:
+        pass
+
+    def convert_to(self, raw_html: str, stream: t.TextIO) -> None:
+        pass
+
+    def convert_stream_to(
+        self,
+        chunks: t.Iterable[t.Union[bytes, str]],
+        stream: t.TextIO,
+        encoding: str = "utf-8",
+    ) -> None:
+        pass
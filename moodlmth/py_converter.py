@@ -5,16 +5,18 @@ import logging
 import re
 import sys
 import typing as t
-import warnings
-from html.parser import HTMLParser
+from collections import ChainMap
+from functools import lru_cache
 from keyword import kwlist
 
-import black
-from htmlmin import minify
-
-from htmldoom import elements
-from moodlmth.const import LEAF_TAGS
+from htmldoom import base, elements, render
+from moodlmth.base import BaseConverter, iter_template, template_parts
+from moodlmth.cache import FormatCache
+from moodlmth.const import DEDUPE_MIN_SIZE, LEAF_TAGS, Formatter
+from moodlmth.emitter import format_statement, verify_with_black
+from moodlmth.limits import NO_LIMITS, Limits
 from moodlmth.protocols import PConverter
+from moodlmth.stats import NULL_STATS, Stats
 
 TEMPLATE = """
 from htmldoom import base as b
@@ -22,38 +24,32 @@ from htmldoom import elements as e
 from htmldoom import render as _render
 from htmldoom import renders
 
-doctype = {doctype}
+{doctype}
 
 
-@renders({title})
+{title}
 def title(data):
     return {{}}
 
 
-@renders({head})
+{head}
 def head(data):
     return {{"title": title(data)}}
 
 
-@renders(e.body()({body}))
+{body}
 def body(data):
     return {{}}
 
 
-@renders({html})
+{html}
 def html(data):
-    return {{
-        "head": head(data=data),
-        "body": body(data=data),
-    }}
+    return {{"head": head(data=data), "body": body(data=data)}}
 
 
 @renders("{{doctype}}{{html}}")
 def document(data):
-    return {{
-        "doctype": doctype,
-        "html": html(data=data),
-    }}
+    return {{"doctype": doctype, "html": html(data=data)}}
 
 
 def render(data):
@@ -65,14 +61,42 @@ if __name__ == "__main__":
 """
 
 
+# Sections of the document rendered by their own function, mapped to the names
+# of the nested sections each of them fills in from its data.
+SECTIONS = {"title": (), "head": ("title",), "body": (), "html": ("head", "body")}
+
+
+RESERVED_KEYWORDS: t.FrozenSet[str] = frozenset(dir(builtins) + kwlist)
+
+
+@lru_cache(maxsize=None)
+def tag_tables() -> t.Tuple[t.Dict[str, str], t.Dict[str, callable]]:
+    """Maps the tag names htmldoom knows to their code and element.
+
+    Built once per process. Converters read them through a ChainMap, so the
+    tags they add for unknown names stay their own.
+    """
+    tagnames, tagmap = {}, {}
+    for name in elements.__all__:
+        tag: object = getattr(elements, name)
+        tagname = name.rstrip("_").replace("_", "-")
+        tagnames[tagname] = f"e.{name}"
+        tagmap[tagname] = tag
+    return tagnames, tagmap
+
+
+def escape(code: str) -> str:
+    """Escapes braces for htmldoom's `renders` templates."""
+    return code.replace("{", "{{").replace("}", "}}")
+
+
 class TagLeaf:
+    __slots__ = ("tagname", "tagattrs", "value")
+
     def __init__(self, tagname, tagattrs="", value=""):
         self.tagname = tagname
         self.tagattrs = tagattrs
         self.value = value
-        self.parent: t.Optional["TagNode"] = None
-        self.next: t.Optional["TagNode"] = None
-        self.prev: t.Optional["TagNode"] = None
 
     def render(self):
         return f"{self.tagname}{self.tagattrs}({repr(self.value)})"
@@ -85,67 +109,245 @@ class TagLeaf:
         return self.render()
 
 
+class ChunkCall(TagLeaf):
+    """Calls the function a run of children was moved to."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return f"{self.tagname}()"
+
+
 class TagNode:
+    # Nodes keep no parent pointer (the converter tracks open tags on a stack)
+    # and childless ones share an empty tuple, so an element costs 64 bytes
+    # plus its children list.
+    __slots__ = ("tagname", "tagattrs", "children", "uid")
+
     def __init__(
         self, tagname: t.Optional[str] = None, tagattrs: t.Optional[str] = None
     ):
         self.tagname: t.Optional[str] = tagname
         self.tagattrs = tagattrs if tagattrs else ""
-        self.children: t.List[t.Union["TagNode", TagTree]] = []
-        self.parent: t.Optional["TagNode"] = None
-        self.next: t.Optional["TagNode"] = None
-        self.prev: t.Optional["TagNode"] = None
+        self.children: t.Sequence[t.Union["TagNode", TagLeaf]] = ()
+        self.uid: t.Optional[int] = None
 
-    def addchild(self, childtag: "TagNode") -> None:
+    def addchild(self, childtag: t.Union["TagNode", TagLeaf]) -> None:
+        if not self.children:
+            self.children = []
         self.children.append(childtag)
-        childtag.parent = self
+
+    @property
+    def section(self) -> t.Optional[str]:
+        if self.tagname in ["e.title", "e.html", "e.body", "e.head"]:
+            return self.tagname[2:]
+        return None
+
+    def iter_code(
+        self,
+        placeholders: t.Optional[t.Container[str]] = None,
+        names: t.Optional[t.Mapping[int, str]] = None,
+        inner: bool = False,
+    ) -> t.Iterator[str]:
+        """Yields the source of the subtree piece by piece.
+
+        Nested sections are replaced by "{name}" slots. With `placeholders`,
+        the code is escaped for `renders` and only the named slots are kept
+        live. Nested subtrees whose uid is in `names` are referred to by that
+        name. With `inner`, only the children are yielded, comma separated.
+        """
+        escaped = placeholders is not None
+
+        # Walks the subtree with an explicit stack of children iterators, so
+        # any nesting depth works at constant Python stack use.
+        stack = [(enumerate(self.children if inner else [self]), "")]
+        while stack:
+            children, closing = stack[-1]
+            for i, child in children:
+                if i:
+                    yield ", "
+                if isinstance(child, TagLeaf):
+                    yield escape(repr(child)) if escaped else repr(child)
+                elif child.section and child is not self:
+                    slot = f'"{{{child.section}}}"'
+                    live = not escaped or child.section in placeholders
+                    yield slot if live else escape(slot)
+                elif names and child.uid in names and child is not self:
+                    yield names[child.uid]
+                else:
+                    head = f"{child.tagname}{child.tagattrs}"
+                    yield escape(head) if escaped else head
+                    if child.children:
+                        yield "("
+                        stack.append((enumerate(child.children), ")"))
+                        break
+            else:
+                stack.pop()
+                yield closing
 
     def render(self):
-        if not self.children:
-            return f"{self.tagname}{self.tagattrs}"
-        return f"{self.tagname}{self.tagattrs}({', '.join(map(repr, self.children))})"
+        return "".join(self.iter_code())
 
     def __repr__(self):
-        if self.tagname in ["e.title", "e.html", "e.body", "e.head"]:
-            return f'''"{{{self.tagname.lstrip('e.')}}}"'''
+        if self.section:
+            return f'"{{{self.section}}}"'
         return self.render()
 
 
-class Converter(HTMLParser, PConverter):
+class Subtrees:
+    """Finds the subtrees a document repeats.
+
+    Subtrees are hash-consed as they close: a node's key is its tag, its
+    attributes and the uids of its children, so structurally equal subtrees
+    share a uid without ever being compared or serialized. Repeated subtrees
+    of at least `min_size` nodes get a name, and are defined once.
+    """
+
+    def __init__(self, min_size: int = DEDUPE_MIN_SIZE) -> None:
+        self.min_size: int = min_size
+        self.uids: t.Dict[t.Tuple[t.Any, ...], int] = {}
+        self.counts: t.List[int] = []
+        self.sizes: t.List[int] = []
+        self.names: t.Dict[int, str] = {}
+
+    def _new(self, size: int) -> int:
+        self.counts.append(0)
+        self.sizes.append(size)
+        return len(self.counts) - 1
+
+    def add(self, node: TagNode) -> None:
+        """Gives a closed node the uid of its structure."""
+        key: t.List[t.Any] = [node.tagname, node.tagattrs]
+        size = 1
+        for child in node.children:
+            if isinstance(child, TagLeaf):
+                key += (child.tagname, child.value)
+                size += 1
+            else:
+                key.append(child.uid)
+                size += self.sizes[child.uid]
+
+        key = tuple(key)
+        uid = self.uids.get(key)
+        if uid is None:
+            uid = self.uids[key] = self._new(size)
+        self.counts[uid] += 1
+        node.uid = uid
+
+    def add_unique(self, node: TagNode) -> None:
+        """Gives a node a uid no other node shares, e.g. for sections."""
+        node.uid = self._new(1)
+        self.counts[node.uid] += 1
+
+    def find(self, root: TagNode) -> t.List[TagNode]:
+        """Names the repeated subtrees under root not named yet.
+
+        A subtree nested in a named one is only named too if it repeats
+        elsewhere, i.e. more often than the subtree it is part of. Returns
+        one node of each new name, nested ones first.
+        """
+        found = []
+        stack = [(iter(root.children), 1, None)]
+        while stack:
+            children, enclosing, named = stack[-1]
+            for child in children:
+                if isinstance(child, TagLeaf) or child.uid in self.names:
+                    continue
+                if child.uid is not None:
+                    count = self.counts[child.uid]
+                    if (
+                        count > 1
+                        and count > enclosing
+                        and self.sizes[child.uid] >= self.min_size
+                    ):
+                        self.names[child.uid] = f"_c{len(self.names)}"
+                        stack.append((iter(child.children), count, child))
+                        break
+                if child.children:
+                    stack.append((iter(child.children), enclosing, None))
+                    break
+            else:
+                stack.pop()
+                if named is not None:
+                    found.append(named)
+        return found
+
+
+class Converter(BaseConverter, PConverter):
     """Converts raw HTML into python source code.
     
     Example:
         
         >>> converter = Converter()
         >>> converter.convert("<html><body>Hello</body></html>")
+
+    With `static`, each section is rendered with htmldoom while parsing and
+    emitted as one `b.raw(...)` fragment around its slots, instead of the
+    elements that build it on import.
+
+    With `chunk_size`, subtrees of more nodes than that are split into
+    functions of about `chunk_size` nodes each, so that formatting and
+    compiling the module stay linear in the page size.
     """
 
-    def __init__(self, fast=False, logger=None) -> None:
+    dedupe: int = DEDUPE_MIN_SIZE
+    static: bool = False
+    chunk_size: t.Optional[int] = None
+
+    def __init__(
+        self,
+        fast=False,
+        logger=None,
+        htmlmin=False,
+        formatter=Formatter.native,
+        cache=None,
+        stats=None,
+        diagnose=True,
+        dedupe=DEDUPE_MIN_SIZE,
+        static=False,
+        limits=None,
+        chunk_size=None,
+    ) -> None:
         super().__init__(convert_charrefs=True)
+        self.limits: Limits = limits or NO_LIMITS
+        self.dedupe: int = dedupe
+        self.static: bool = static
+        self.chunk_size: t.Optional[int] = chunk_size
+        self.htmlmin: bool = htmlmin
+        self.diagnose: bool = diagnose
+        self.formatter: Formatter = formatter
+        self.cache: t.Optional[FormatCache] = cache
+        self.stats: Stats = stats or NULL_STATS
         self.template = TEMPLATE
-        self.reserved_keywords: t.Set[str] = set(dir(builtins) + kwlist)
-        self.tagnames: t.Dict[str, str] = {}
-        self.tagmap: t.Dict[str, callable] = {}
-        self.black_file_mode: black.FileMode = black.FileMode(
-            target_versions={}, is_pyi=False, line_length=79, string_normalization=True
-        )
+        self.reserved_keywords: t.FrozenSet[str] = RESERVED_KEYWORDS
         self.fast: bool = fast
+        self.log = logger if logger else logging.getLogger(__name__)
+
+    def reset(self) -> None:
+        """Forgets everything parsed so far, so the converter can be reused."""
+        super().reset()
+        shared_tagnames, shared_tagmap = tag_tables()
+        self.tagnames: t.ChainMap[str, str] = ChainMap({}, shared_tagnames)
+        self.tagmap: t.ChainMap[str, callable] = ChainMap({}, shared_tagmap)
         self._tagtree: TagNode = TagNode()
         self._currtag: TagNode = self._tagtree
+        self._parents: t.List[TagNode] = []
         self._doctype: str = "html"
         self._title: str = ""
         self._html: str = ""
         self._head: str = ""
         self._body: str = ""
-        self.log = logger if logger else logging.getLogger(__name__)
-        self._init_tagmap()
-
-    def _init_tagmap(self) -> None:
-        for name in elements.__all__:
-            tag: object = getattr(elements, name)
-            tagname = name.rstrip("_").replace("_", "-")
-            self.tagnames[tagname] = f"e.{name}"
-            self.tagmap[tagname] = tag
+        self._subtrees: t.Optional[Subtrees] = (
+            Subtrees(self.dedupe) if self.dedupe and not self.static else None
+        )
+        # Module level definitions: assignments, or the functions chunks were
+        # moved to, as (function name or None, statement).
+        self._definitions: t.List[t.Tuple[t.Optional[str], str]] = []
+        self._chunks: int = 0
+        # Static mode: the rendered pieces of each open section, and the end
+        # tag of each open element with the section it closes, if any.
+        self._fragments: t.List[t.Tuple[str, t.List[str]]] = []
+        self._closings: t.List[t.Tuple[str, t.Optional[str]]] = []
 
     def handle_decl(self, decl) -> None:
         if decl.lower().startswith("doctype "):
@@ -154,31 +356,60 @@ class Converter(HTMLParser, PConverter):
         raise ValueError(f"Unknown declaration: {decl}")  # pragma: nocover
 
     def handle_comment(self, data) -> None:
+        self.stats.count("comments")
+        self.count_node(len(self._parents))
+        if self.static:
+            self._emit(escape(render(base.comment(data))))
+            return
         self._currtag.addchild(TagLeaf("b.comment", value=data))
 
     def handle_data(self, data) -> None:
         if not data:  # pragma: nocover
             return
         if self._currtag.tagname in ["e.script", "e.style", "e.textarea"]:
+            self.stats.count("texts")
+            self.count_node(len(self._parents))
+            if self.static:
+                self._emit(escape(data))
+                return
             self._currtag.addchild(TagLeaf("b.raw", value=data))
             return
-        self._currtag.addchild(TagLeaf("b.txt", value=data))
+        data = self.collapse_whitespace(
+            data,
+            strip=self._currtag.tagname == "e.title",
+            drop_blank=self._currtag.tagname == "e.head",
+        )
+        if data:
+            self.stats.count("texts")
+            self.count_node(len(self._parents))
+            if self.static:
+                self._emit(escape(render(data)))
+                return
+            self._currtag.addchild(TagLeaf("b.txt", value=data))
 
     def handle_startendtag(self, tag, attrs):
         tag = tag.lower()
-        self.log.debug(f"Handling leaf tag: {tag}")
+        self.log.debug("Handling leaf tag: %s", tag)
         if tag not in self.tagmap:
-            warnings.warn(f"Tag not found in htmldoom: {tag}")
             self.tagnames[tag] = f"b.leaf_tag({repr(tag)})"
             self.tagmap[tag] = elements.leaf_tag(tag)
-        fmt_attrs = self._fmt_attrs(attrs)
-        self._currtag.addchild(TagNode(self.tagnames[tag], tagattrs=fmt_attrs))
+        if tag in self.tagnames.maps[0]:
+            self.diagnostics.add("unknown tag", tag)
+        _attrs, _props = self._split_attrs(attrs)
+        self.stats.count("elements")
+        self.count_node(len(self._parents) + 1)
+        if self.static:
+            self._emit(escape(render(self.tagmap[tag](*_attrs, **_props))))
+            return
+        node = TagNode(self.tagnames[tag], tagattrs=self._fmt_attrs(_attrs, _props))
+        if self._subtrees:
+            self._subtrees.add(node)
+        self._currtag.addchild(node)
 
     def handle_starttag(self, tag, attrs):
         tag = tag.lower()
 
         if tag not in self.tagmap:
-            warnings.warn(f"Tag not found in htmldoom: {tag}")
             self.tagnames[tag] = f"b.composite_tag({repr(tag)})"
             self.tagmap[tag] = elements.composite_tag(tag)
 
@@ -186,33 +417,171 @@ class Converter(HTMLParser, PConverter):
             self.handle_startendtag(tag, attrs)
             return
 
-        self.log.debug(f"Starting composite tag: {tag}")
+        if tag in self.tagnames.maps[0]:
+            self.diagnostics.add("unknown tag", tag)
+
+        self.log.debug("Starting composite tag: %s", tag)
         tag = tag.lower()
-        fmt_attrs = self._fmt_attrs(attrs)
-        self._currtag.addchild(TagNode(self.tagnames[tag], tagattrs=fmt_attrs))
-        self._currtag = self._currtag.children[-1]
+        _attrs, _props = self._split_attrs(attrs)
+        self.stats.count("elements")
+        self._parents.append(self._currtag)
+        self.count_node(len(self._parents))
+        if self.static:
+            # Only the open elements are kept, their content is rendered.
+            self._open_static(tag, _attrs, _props)
+            self._currtag = TagNode(self.tagnames[tag])
+        else:
+            node = TagNode(self.tagnames[tag], tagattrs=self._fmt_attrs(_attrs, _props))
+            self._currtag.addchild(node)
+            self._currtag = node
+        self.enter_tag(tag)
 
     def handle_endtag(self, tag):
         tag = tag.lower()
-        if not self._currtag or not self._currtag.parent:
+        if not self._parents:
             raise ValueError(f"Tag closed before starting: {tag}")
 
-        self.log.debug(f"Closing composite tag: {tag}")
-        if self.tagnames[tag] != self._currtag.tagname:
-            warnings.warn(f"Tag was never closed: {self._currtag.tagname}", Warning)
-
-        if tag == "title":
-            self._title = self._currtag.render()
-        if tag == "html":
-            self._html = self._currtag.render()
-        if tag == "head":
-            self._head = self._currtag.render()
-        if tag == "body":
-            self._body = self._currtag.render()
-
-        self._currtag = self._currtag.parent
+        self.log.debug("Closing composite tag: %s", tag)
+        if self.tagnames.get(tag) != self._currtag.tagname:
+            self.diagnostics.add("mismatched end tag", tag)
+
+        if self.static:
+            self._close_static()
+        elif self._subtrees:
+            if self._currtag.section:
+                self._subtrees.add_unique(self._currtag)
+            else:
+                self._subtrees.add(self._currtag)
+
+        if tag in SECTIONS and not self.static:
+            # Each section is serialized once, escaped for `renders`, when it
+            # closes. Enclosing sections only refer to it by its slot, so its
+            # subtree is not needed anymore.
+            names = self._define_repeats(self._currtag)
+            if self.chunk_size:
+                self._split(self._currtag, SECTIONS[tag], names)
+            code = "".join(self._currtag.iter_code(SECTIONS[tag], names))
+            setattr(self, f"_{tag}", code)
+            self._currtag.children = ()
+
+        self.leave_tag(tag)
+        self._currtag = self._parents.pop()
+
+    def _define_repeats(self, section: TagNode) -> t.Optional[t.Dict[int, str]]:
+        """Defines the subtrees repeated in a section, returns their names.
+
+        The definitions are used inside `renders`, so they are escaped like
+        the sections.
+        """
+        if not self._subtrees:
+            return None
+        names = self._subtrees.names
+        for node in self._subtrees.find(section):
+            if self.chunk_size:
+                self._split(node, (), names)
+            code = "".join(node.iter_code((), names))
+            self._definitions.append((None, f"{names[node.uid]} = {code}"))
+            self.stats.count("shared_subtrees")
+        return names
+
+    def _split(
+        self,
+        root: TagNode,
+        placeholders: t.Container[str],
+        names: t.Optional[t.Mapping[int, str]],
+    ) -> None:
+        """Moves children out of the subtrees larger than `chunk_size` nodes.
+
+        Subtrees are split deepest first: whenever the nodes still inline in
+        a subtree exceed `chunk_size`, its children are moved, in runs of at
+        most that many nodes, to functions the subtree calls instead. This
+        bounds both the size and the nesting of every generated statement.
+        """
+        stack = [(root, iter(root.children), [])]
+        while stack:
+            node, children, sizes = stack[-1]
+            for child in children:
+                if (
+                    isinstance(child, TagLeaf)
+                    or not child.children
+                    or child.section
+                    or (names and child.uid in names)
+                ):
+                    sizes.append(1)
+                    continue
+                stack.append((child, iter(child.children), []))
+                break
+            else:
+                stack.pop()
+                size = 1 + sum(sizes)
+                if size > self.chunk_size:
+                    size = 1 + self._chunk(node, sizes, placeholders, names)
+                if stack:
+                    stack[-1][2].append(size)
+
+    def _chunk(
+        self,
+        node: TagNode,
+        sizes: t.List[int],
+        placeholders: t.Container[str],
+        names: t.Optional[t.Mapping[int, str]],
+    ) -> int:
+        """Replaces the children of node by chunk calls, returns their number."""
+        calls: t.List[t.Union[TagNode, TagLeaf]] = []
+        run = TagNode()
+        total = 0
+        for child, size in zip(node.children, sizes):
+            if run.children and total + size > self.chunk_size:
+                calls.append(self._define_chunk(run, placeholders, names))
+                run, total = TagNode(), 0
+            run.addchild(child)
+            total += size
+        calls.append(self._define_chunk(run, placeholders, names))
+        node.children = calls
+        return len(calls)
+
+    def _define_chunk(
+        self,
+        run: TagNode,
+        placeholders: t.Container[str],
+        names: t.Optional[t.Mapping[int, str]],
+    ) -> ChunkCall:
+        # The children are rendered like any others, the escaped code and the
+        # slots end up in the template of the enclosing section.
+        name = f"_p{self._chunks}"
+        self._chunks += 1
+        code = "".join(run.iter_code(placeholders, names, inner=True))
+        self._definitions.append((name, f"return b.raw(_render({code}))"))
+        self.stats.count("chunks")
+        return ChunkCall(name)
+
+    def _emit(self, piece: str) -> None:
+        if self._fragments:
+            self._fragments[-1][1].append(piece)
+
+    def _open_static(
+        self, tag: str, _attrs: t.List[str], _props: t.Dict[str, str]
+    ) -> None:
+        html = render(self.tagmap[tag](*_attrs, **_props)())
+        cut = html.rindex("</")
+        section = tag if tag in SECTIONS else None
+        if section:
+            self._fragments.append((section, []))
+        self._emit(escape(html[:cut]))
+        self._closings.append((escape(html[cut:]), section))
+
+    def _close_static(self) -> None:
+        closing, section = self._closings.pop()
+        self._emit(closing)
+        if not section:
+            return
+        _, pieces = self._fragments.pop()
+        setattr(self, f"_{section}", "".join(pieces))
+        slot = f"{{{section}}}"
+        live = self._fragments and section in SECTIONS[self._fragments[-1][0]]
+        self._emit(slot if live else escape(slot))
 
-    def _fmt_attrs(self, attrs):
+    def _split_attrs(self, attrs) -> t.Tuple[t.List[str], t.Dict[str, str]]:
         _attrs, _props = [], {}
 
         for k, v in attrs:
@@ -222,39 +591,111 @@ class Converter(HTMLParser, PConverter):
 
             k = k.replace("-", "_")
             if k in self.reserved_keywords:
+                self.diagnostics.add("renamed attribute", f"{k} -> {k}_")
                 k = f"{k}_"
             _props[k] = v
+        return _attrs, _props
 
+    def _fmt_attrs(self, _attrs: t.List[str], _props: t.Dict[str, str]) -> str:
         fmt_attrs = ", ".join(repr(x) for x in _attrs)
         fmt_props = ", ".join(f"{k}={repr(v)}" for k, v in _props.items())
 
         if _attrs and _props:
-            return f"({fmt_attrs}, {fmt_props})"
+            fmt = f"({fmt_attrs}, {fmt_props})"
+        elif _attrs:
+            fmt = f"({fmt_attrs})"
+        else:
+            fmt = f"({fmt_props})"
 
-        if _attrs:
-            return f"({fmt_attrs})"
+        # Pages repeat the same attributes a lot, keep one copy of each.
+        return sys.intern(fmt)
 
-        return f"({fmt_props})"
-
-    def convert(self, raw_html):
-        """Do the conversion.
-        
-        raw_html: The raw html text to convert.
-        """
-        self.feed(minify(raw_html, remove_empty_space=True))
-        result = self.template.format(
-            doctype=self._doctype,
-            title=self._title.replace("{", "{{").replace("}", "}}"),
-            head=self._head.replace("{", "{{")
-            .replace("}", "}}")
-            .replace('"{{title}}"', '"{title}"'),
-            html=self._html.replace("{", "{{")
-            .replace("}", "}}")
-            .replace('"{{head}}"', '"{head}"')
-            .replace('"{{body}}"', '"{body}"'),
-            body=self._body.replace("{", "{{").replace("}", "}}"),
+    def _check_unclosed(self) -> None:
+        if not self._parents:
+            return
+        names = {code: tag for tag, code in self.tagnames.items()}
+        for node in self._parents[1:] + [self._currtag]:
+            self.diagnostics.add("unclosed tag", names.get(node.tagname, node.tagname))
+
+    def _format_definitions(self, doctype: str) -> str:
+        blocks, after_function = [doctype], False
+        for name, line in self._definitions:
+            self.check_time()
+            code = format_statement(
+                line,
+                formatter=self.formatter,
+                fast=self.fast,
+                depth=1 if name else 0,
+                cache=self.cache,
+            )
+            if name:
+                blocks.append(f"def {name}():\n{code}")
+            elif after_function:
+                blocks.append(code)
+            else:
+                blocks[-1] = f"{blocks[-1]}\n{code}"
+            after_function = name is not None
+        # Functions are surrounded by two blank lines.
+        return "\n\n\n".join(blocks)
+
+    def iter_generate(self) -> t.Iterator[str]:
+        self._check_unclosed()
+        if self.static:
+            body = f"<body>{self._body}</body>"
+            lines = dict(
+                doctype=f"doctype = {self._doctype}",
+                title=f"@renders(b.raw({self._title!r}))",
+                head=f"@renders(b.raw({self._head!r}))",
+                body=f"@renders(b.raw({body!r}))",
+                html=f"@renders(b.raw({self._html!r}))",
+            )
+        else:
+            lines = dict(
+                doctype=f"doctype = {self._doctype}",
+                title=f"@renders({self._title})",
+                head=f"@renders({self._head})",
+                body=f"@renders(e.body()({self._body}))",
+                html=f"@renders({self._html})",
+            )
+
+        # Formatting only adds whitespace, so the code is already too large
+        # if it is before.
+        self.count_output(
+            sum(map(len, lines.values()))
+            + sum(len(line) for _, line in self._definitions)
         )
 
-        return black.format_file_contents(
-            result, fast=self.fast, mode=self.black_file_mode
-        )
+        def formatted(name: str) -> t.Callable[[], str]:
+            def format_() -> str:
+                self.check_time()
+                with self.stats.phase("render"):
+                    code = format_statement(
+                        lines.pop(name),
+                        formatter=self.formatter,
+                        fast=self.fast,
+                        cache=self.cache,
+                    )
+                    if name == "doctype":
+                        # Repeated subtrees and chunks are defined right after
+                        # the doctype, before the sections that refer to them.
+                        code = self._format_definitions(code)
+                return code
+
+            return format_
+
+        with self.stats.phase("template"):
+            parts = template_parts(self.template.lstrip("\n"))
+        # Each section is formatted when the template gets to it, and its code
+        # is dropped once formatted.
+        pieces = iter_template(parts, {name: formatted(name) for name in lines})
+
+        if self.formatter is Formatter.verify:
+            # black needs the whole module.
+            result = "".join(pieces)
+            with self.stats.phase("black"):
+                result = verify_with_black(
+                    result, fast=self.fast, mode=self.black_file_mode, logger=self.log
+                )
+            yield result
+            return
+        yield from pieces
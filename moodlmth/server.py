@@ -0,0 +1,286 @@
+"Serves conversions from a long-running process."
+
+import json
+import logging
+import os
+import socketserver
+import stat
+import sys
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from moodlmth.base import CHUNK_SIZE
+from moodlmth.const import DEFAULT_MAX_IN_FLIGHT, DEFAULT_TIMEOUT, Syntax
+from moodlmth.pool import ConverterPool
+from moodlmth.protocols import PConverter
+
+# How long an HTTP request waits for a free slot before getting a 503.
+SLOT_TIMEOUT = 1.0
+# Largest HTTP request body accepted, unless the service is given another.
+DEFAULT_MAX_BODY = 16 * 1024 * 1024
+
+
+class Service:
+    """Converts requests on warm converters.
+
+    A request is a dict with the document as "html" or a "url" to fetch it
+    from, and optionally the "syntax" ("python" or "yaml"), "fast", and an
+    "id" that is echoed back. The response has the "output", or an "error".
+    Converters are pooled per syntax and fast setting and reused, and at
+    most `max_in_flight` documents are converted at a time: the front ends
+    take a slot from `in_flight` before reading a request. Request bodies
+    over `max_body` bytes are rejected unread.
+
+    Example:
+
+        >>> service = Service(lambda syntax, fast: load_converter(...))
+        >>> service.handle({"id": 1, "html": "<html><body>Hi</body></html>"})
+    """
+
+    def __init__(
+        self,
+        factory: t.Callable[[Syntax, bool], PConverter],
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        timeout: float = DEFAULT_TIMEOUT,
+        logger: t.Optional[logging.Logger] = None,
+        max_body: int = DEFAULT_MAX_BODY,
+    ) -> None:
+        if max_in_flight < 1:
+            raise ValueError(f"Max in flight must be at least 1: {max_in_flight}")
+        self.factory = factory
+        self.max_in_flight = max_in_flight
+        self.max_body = max_body
+        self.timeout = timeout
+        self.log = logger if logger else logging.getLogger(__name__)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._pools: t.Dict[t.Tuple[Syntax, bool], ConverterPool] = {}
+        self._fetcher = None
+        self._lock = threading.Lock()
+
+    def pool(self, syntax: Syntax, fast: bool) -> ConverterPool:
+        with self._lock:
+            pool = self._pools.get((syntax, fast))
+            if pool is None:
+                pool = self._pools[(syntax, fast)] = ConverterPool(
+                    lambda: self.factory(syntax, fast), size=self.max_in_flight
+                )
+            return pool
+
+    def fetch(self, url: str) -> str:
+        with self._lock:
+            if self._fetcher is None:
+                from moodlmth.fetch import Fetcher
+
+                self._fetcher = Fetcher(
+                    concurrency=self.max_in_flight, timeout=self.timeout
+                )
+        return self._fetcher.get(url)
+
+    def request_pool(self, request: t.Mapping[str, t.Any]) -> ConverterPool:
+        syntax = Syntax[request.get("syntax", Syntax.python.name)]
+        return self.pool(syntax, bool(request.get("fast", False)))
+
+    def convert(self, request: t.Dict[str, t.Any]) -> str:
+        if "html" in request:
+            content = request["html"]
+        elif "url" in request:
+            content = self.fetch(request["url"])
+        else:
+            raise ValueError('Expected "html" or "url"')
+        return self.request_pool(request).convert(content)
+
+    def handle(self, request: t.Any) -> t.Dict[str, t.Any]:
+        """Converts a request, reporting any failure in the response."""
+        if isinstance(request, (str, bytes)):
+            try:
+                request = json.loads(request)
+            except ValueError as e:
+                return {"error": f"Invalid request: {e}"}
+        if not isinstance(request, dict):
+            return {"error": "Invalid request: expected a JSON object"}
+
+        return self._respond(request, lambda: self.convert(request))
+
+    def handle_stream(
+        self,
+        request: t.Mapping[str, t.Any],
+        chunks: t.Iterable[bytes],
+        encoding: str = "utf-8",
+    ) -> t.Dict[str, t.Any]:
+        """Converts a document read from chunks, with the rest of the request.
+
+        The document is parsed as it arrives, so it is never held whole.
+        """
+        return self._respond(
+            request,
+            lambda: self.request_pool(request).convert_stream(
+                chunks, encoding=encoding
+            ),
+        )
+
+    def _respond(
+        self, request: t.Mapping[str, t.Any], convert: t.Callable[[], str]
+    ) -> t.Dict[str, t.Any]:
+        response = {"id": request["id"]} if "id" in request else {}
+        try:
+            response["output"] = convert()
+        except Exception as e:
+            self.log.debug("Conversion failed", exc_info=True)
+            response["error"] = f"{type(e).__name__}: {e}"
+        return response
+
+    def close(self) -> None:
+        if self._fetcher is not None:
+            self._fetcher.close()
+
+
+def serve_lines(service: Service, infile: t.TextIO, outfile: t.TextIO) -> None:
+    """Serves JSON lines: one request per input line, one response per output line.
+
+    Responses are written as the conversions finish, so they can come out
+    of order (use "id" to match them). Once `max_in_flight` documents are
+    being converted, no more lines are read until one finishes, which
+    pushes back on the writer through the pipe.
+    """
+    write_lock = threading.Lock()
+
+    def run(line: str) -> None:
+        try:
+            response = service.handle(line)
+            with write_lock:
+                outfile.write(json.dumps(response) + "\n")
+                outfile.flush()
+        finally:
+            service.in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=service.max_in_flight) as executor:
+        for line in infile:
+            if not line.strip():
+                continue
+            service.in_flight.acquire()
+            executor.submit(run, line)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Converts the request POSTed to any path.
+
+    The body is either a JSON request, or with a text/html Content-Type the
+    document itself, streamed to the parser, with the other fields of the
+    request in the query string (e.g. "?syntax=yaml&fast=1&id=7").
+
+    Answers 411 without a Content-Length, 413 when the body is over the
+    service's `max_body`, 503 when all the slots stay busy for SLOT_TIMEOUT
+    seconds, and 422 when the conversion fails.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        service: Service = self.server.service
+        try:
+            length = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            self.reject(411, "Content-Length required")
+            return
+        if length > service.max_body:
+            self.reject(413, f"Request body exceeds {service.max_body} bytes")
+            return
+        if not service.in_flight.acquire(timeout=SLOT_TIMEOUT):
+            self.reject(503, "Too many documents in flight")
+            return
+        try:
+            if self.headers.get_content_type() == "text/html":
+                response = service.handle_stream(
+                    self.query(),
+                    self.iter_body(length),
+                    encoding=self.headers.get_content_charset("utf-8"),
+                )
+            else:
+                response = service.handle(self.rfile.read(length))
+        finally:
+            service.in_flight.release()
+        self.respond(422 if "error" in response else 200, response)
+
+    def query(self) -> t.Dict[str, t.Any]:
+        request: t.Dict[str, t.Any] = dict(parse_qsl(urlsplit(self.path).query))
+        if "fast" in request:
+            request["fast"] = request["fast"].lower() in {"1", "true", "yes"}
+        return request
+
+    def iter_body(self, length: int) -> t.Iterator[bytes]:
+        # The connection can only be reused once the whole body is read, which
+        # a failed conversion may not do.
+        close_connection, self.close_connection = self.close_connection, True
+        while length:
+            chunk = self.rfile.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+        self.close_connection = close_connection
+
+    def reject(self, status: int, error: str) -> None:
+        # The body is left unread, so the connection can't be reused.
+        self.close_connection = True
+        self.respond(status, {"error": error})
+
+    def respond(self, status: int, response: t.Dict[str, t.Any]) -> None:
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else "-"
+
+    def log_message(self, format: str, *args: t.Any) -> None:
+        self.server.service.log.debug(format, *args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+def make_server(service: Service, address: str) -> socketserver.BaseServer:
+    """Creates an HTTP server listening on "host:port" or a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+    else:
+        # Replace the socket left behind by a previous run, but nothing else.
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.unlink(address)
+        server = ThreadingUnixHTTPServer(address, Handler)
+    server.service = service
+    return server
+
+
+def serve(service: Service, address: str) -> None:
+    """Serves until interrupted: JSON lines over stdin/stdout for "-", else HTTP."""
+    if address == "-":
+        serve_lines(service, sys.stdin, sys.stdout)
+        return
+
+    server = make_server(service, address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, socketserver.UnixStreamServer):
+            os.unlink(address)
@@ -0,0 +1,94 @@
+"Measures where the time of a conversion goes."
+
+import time
+import typing as t
+from collections import defaultdict
+
+
+class Timer:
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats: "Stats", name: str) -> None:
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc: t.Any) -> None:
+        self.stats.phases[self.name] += time.perf_counter() - self.start
+
+
+class Stats:
+    """Wall time per phase and counters, summed over conversions.
+
+    callback: Called with the stats after each conversion.
+
+    Example:
+
+        >>> stats = Stats(callback=lambda s: print(s.asdict()))
+        >>> Converter(stats=stats).convert(raw_html)
+        {'phases': {'parse': 0.0012, ...}, 'counters': {'elements': 42, ...}}
+    """
+
+    enabled = True
+
+    def __init__(self, callback: t.Optional[t.Callable[["Stats"], None]] = None):
+        self.callback = callback
+        self.phases: t.Dict[str, float] = defaultdict(float)
+        self.counters: t.Dict[str, int] = defaultdict(int)
+
+    def phase(self, name: str) -> Timer:
+        """Times the block as part of the named phase."""
+        return Timer(self, name)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def done(self) -> None:
+        """Marks the end of a conversion."""
+        self.counters["conversions"] += 1
+        if self.callback:
+            self.callback(self)
+
+    def merge(self, other: t.Dict[str, t.Dict[str, t.Any]]) -> None:
+        """Adds stats in the format of `asdict()`, e.g. from another process."""
+        for name, seconds in other["phases"].items():
+            self.phases[name] += seconds
+        for name, n in other["counters"].items():
+            self.counters[name] += n
+
+    def asdict(self) -> t.Dict[str, t.Dict[str, t.Any]]:
+        return {"phases": dict(self.phases), "counters": dict(self.counters)}
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc: t.Any) -> None:
+        pass
+
+
+class NullStats(Stats):
+    """Stats that measure nothing, used when instrumentation is disabled."""
+
+    enabled = False
+
+    def __init__(self) -> None:
+        super().__init__()
+
+    def phase(self, name: str) -> NullTimer:  # type: ignore
+        return NULL_TIMER
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+    def done(self) -> None:
+        pass
+
+
+NULL_TIMER = NullTimer()
+NULL_STATS = NullStats()
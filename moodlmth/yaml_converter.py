@@ -1,19 +1,42 @@
 import logging
+import re
+import sys
 import typing as t
-import warnings
 from dataclasses import dataclass
-from html.parser import HTMLParser
-from pathlib import Path
 
-import black
-from htmlmin import minify
-from yaml import dump
-
-from moodlmth.const import LEAF_TAGS
+from yaml import (
+    DocumentEndEvent,
+    DocumentStartEvent,
+    Dumper,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    ScalarNode,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+
+try:
+    from yaml import CDumper
+except ImportError:  # pragma: nocover
+    CDumper = Dumper
+
+from moodlmth.assets import DEFAULT_DIRECTORY, AssetStore
+from moodlmth.base import BaseConverter
+from moodlmth.cache import FormatCache
+from moodlmth.const import LEAF_TAGS, Formatter
+from moodlmth.emitter import (
+    format_statement,
+    normalize_string_quotes,
+    verify_with_black,
+)
+from moodlmth.limits import NO_LIMITS, Limits, utf8_size
 from moodlmth.protocols import PConverter
+from moodlmth.stats import NULL_STATS, Stats
 
 RENDERER_TEMPLATE = """
-@renders(lr(f"{{ASSETS}}/{varname}.txt", static=True))
+
+@renders(lr(f"{{ASSETS}}/{filename}", static=True))
 def {varname}():
     return {{}}
 """
@@ -22,13 +45,13 @@ TEMPLATE = """
 from htmldoom import doctype, render, renders, loadraw as lr
 from htmldoom.yaml_loader import loadyaml as ly
 
-ASSETS = "assets"
-COMPONENTS = f"{{ASSETS}}/components.yml"
-
+ASSETS = {assets}
+COMPONENTS = f"{{ASSETS}}/{components}"
 {raw_renderers}
+
 @renders(doctype("{doctype}"), ly(COMPONENTS))
 def document():
-    return {raw_elements}
+{document}
 
 
 if __name__ == "__main__":
@@ -44,32 +67,41 @@ class RendererCall:
         return f"{self.varname}()"
 
 
+# The tree classes use slots and keep no parent pointer, the converter tracks
+# open tags on a stack instead. Attributes are kept as a tuple of pairs, which
+# takes a fraction of a dict's memory, and turned into a dict when rendered.
+Attributes = t.Tuple[t.Tuple[str, t.Union[str, bool]], ...]
+
+
 @dataclass
 class LeafTag:
-    parent: t.Union["LeafTag", "CompositeTag", "Document"]
+    __slots__ = ("tagname", "attributes")
     tagname: str
-    attributes: t.Dict[str, str]
+    attributes: "Attributes"
 
     def render(self):
-        return {self.tagname: [self.attributes]}
+        return {self.tagname: [dict(self.attributes)]}
 
 
 @dataclass
 class CompositeTag:
-    parent: t.Union["LeafTag", "CompositeTag", "Document"]
+    __slots__ = ("tagname", "attributes", "children")
     tagname: str
-    attributes: t.Dict[str, str]
-    children: t.List[t.Union[LeafTag, "CompositeTag", str]]
+    attributes: "Attributes"
+    children: t.List[t.Union[LeafTag, "CompositeTag", "Txt"]]
 
     def render(self):
+        return self.wrap(render_children(self.children))
+
+    def wrap(self, children: t.List[t.Any]) -> t.Dict[str, t.List[t.Any]]:
         if not self.attributes:
-            return {self.tagname: [[c.render() for c in self.children]]}
-        return {self.tagname: [self.attributes, [c.render() for c in self.children]]}
+            return {self.tagname: [children]}
+        return {self.tagname: [dict(self.attributes), children]}
 
 
 @dataclass
 class Txt:
-    parent: t.Union["LeafTag", "CompositeTag", "Document"]
+    __slots__ = ("content",)
     content: str
 
     def render(self):
@@ -78,7 +110,7 @@ class Txt:
 
 @dataclass
 class Comment:
-    parent: t.Union["LeafTag", "CompositeTag", "Document"]
+    __slots__ = ("content",)
     content: str
 
     def render(self):
@@ -91,7 +123,154 @@ class Document:
     children: t.List[t.Union[LeafTag, "CompositeTag", str]]
 
     def render(self):
-        return [c.render() for c in self.children]
+        return render_children(self.children)
+
+
+def render_children(children: t.List[t.Any]) -> t.List[t.Any]:
+    """Renders a list of nodes into YAML-ready data without recursion.
+
+    Each composite tag's children list is created empty, attached to its
+    parent's output and filled when the tag is taken off the stack.
+    """
+    rendered: t.List[t.Any] = []
+    stack = [(children, rendered)]
+    while stack:
+        nodes, out = stack.pop()
+        for node in nodes:
+            if isinstance(node, CompositeTag):
+                sub: t.List[t.Any] = []
+                out.append(node.wrap(sub))
+                stack.append((node.children, sub))
+            else:
+                out.append(node.render())
+    return rendered
+
+
+STR_TAG = "tag:yaml.org,2002:str"
+BOOL_TAG = "tag:yaml.org,2002:bool"
+SEQUENCE_START = SequenceStartEvent(
+    None, "tag:yaml.org,2002:seq", True, flow_style=False
+)
+SEQUENCE_END = SequenceEndEvent()
+MAPPING_START = MappingStartEvent(None, "tag:yaml.org,2002:map", True, flow_style=False)
+MAPPING_END = MappingEndEvent()
+
+
+PRINTABLE_ASCII = re.compile(r"[ -~]*")
+YAML_WIDTH = 80
+
+
+def escaped_length(value: str) -> int:
+    """Upper bound of the width of a double-quoted scalar."""
+    return 2 + sum(
+        1 if " " <= ch <= "~" else 4 if ch <= "\xff" else 6 if ch <= "\uffff" else 10
+        for ch in value
+    )
+
+
+def may_fold_escapes(doc: Document) -> bool:
+    """Whether a scalar with escapes could have to be folded.
+
+    libyaml only breaks double-quoted scalars at spaces, while PyYAML's own
+    emitter may also break them after an escape sequence. Only such scalars
+    make the two emit different output, so the column and width of each of
+    them are estimated from its nesting depth.
+    """
+    stack = [iter(doc.children)]
+    while stack:
+        column = 4 * len(stack) - 2
+        for node in stack[-1]:
+            if isinstance(node, (LeafTag, CompositeTag)):
+                values = [(node.tagname, column)]
+                values += [
+                    (v, column + len(k) + 6)
+                    for k, v in node.attributes
+                    if v is not True
+                ]
+                for value, col in values:
+                    if not PRINTABLE_ASCII.fullmatch(value):
+                        if col + escaped_length(value) > YAML_WIDTH:
+                            return True
+                if isinstance(node, CompositeTag):
+                    stack.append(iter(node.children))
+                    break
+                continue
+            value = node.render()
+            if not PRINTABLE_ASCII.fullmatch(value):
+                if column + escaped_length(value) > YAML_WIDTH:
+                    return True
+        else:
+            stack.pop()
+    return False
+
+
+def dump_document(doc: Document, stream: t.TextIO) -> None:
+    """Writes the document as YAML, the same as `yaml.dump(doc.render(), stream)`.
+
+    The events are emitted straight from the tree, walked with an explicit
+    stack, so the rendered structure is never built. Like yaml.dump, mappings
+    have sorted keys, collections use the block style and the scalars' tags
+    are left implicit when the resolver would detect them anyway.
+
+    libyaml's CDumper is used unless its output could differ from PyYAML's
+    (see `may_fold_escapes()`).
+    """
+    dumper_class = Dumper if may_fold_escapes(doc) else CDumper
+    dumper = dumper_class(stream, default_flow_style=False, sort_keys=True)
+    emit = dumper.emit
+    implicit: t.Dict[str, t.Tuple[bool, bool]] = {}
+
+    def scalar(value: t.Union[str, bool]) -> None:
+        if value is True:
+            value, tag = "true", BOOL_TAG
+        else:
+            tag = STR_TAG
+        key = f"{tag}:{value}"
+        if key not in implicit:
+            implicit[key] = (
+                dumper.resolve(ScalarNode, value, (True, False)) == tag,
+                dumper.resolve(ScalarNode, value, (False, True)) == tag,
+            )
+        emit(ScalarEvent(None, tag, implicit[key], value))
+
+    def attributes(attrs: Attributes) -> None:
+        emit(MAPPING_START)
+        for name, value in sorted(dict(attrs).items()):
+            scalar(name)
+            scalar(value)
+        emit(MAPPING_END)
+
+    try:
+        dumper.open()
+        emit(DocumentStartEvent(explicit=False))
+        emit(SEQUENCE_START)
+        stack = [iter(doc.children)]
+        while stack:
+            for node in stack[-1]:
+                if isinstance(node, (LeafTag, CompositeTag)):
+                    emit(MAPPING_START)
+                    scalar(node.tagname)
+                    emit(SEQUENCE_START)
+                    if isinstance(node, LeafTag) or node.attributes:
+                        attributes(node.attributes)
+                    if isinstance(node, LeafTag):
+                        emit(SEQUENCE_END)
+                        emit(MAPPING_END)
+                        continue
+                    emit(SEQUENCE_START)
+                    stack.append(iter(node.children))
+                    break
+                scalar(node.render())
+            else:
+                stack.pop()
+                emit(SEQUENCE_END)
+                if stack:
+                    emit(SEQUENCE_END)
+                    emit(MAPPING_END)
+        emit(DocumentEndEvent(explicit=False))
+        dumper.close()
+    finally:
+        dumper.dispose()
 
 
 @dataclass(frozen=False)
@@ -100,17 +279,38 @@ class RawFile:
     content: str
 
 
-class Converter(HTMLParser, PConverter):
-    def __init__(self, fast: bool = False, logger: logging.Logger = None):
+class Converter(BaseConverter, PConverter):
+    def __init__(
+        self,
+        fast: bool = False,
+        logger: logging.Logger = None,
+        htmlmin: bool = False,
+        formatter: Formatter = Formatter.native,
+        cache: t.Optional[FormatCache] = None,
+        assets: str = DEFAULT_DIRECTORY,
+        stats: t.Optional[Stats] = None,
+        diagnose: bool = True,
+        limits: t.Optional[Limits] = None,
+    ):
         super().__init__(convert_charrefs=True)
+        self.limits = limits or NO_LIMITS
+        self.htmlmin = htmlmin
+        self.diagnose = diagnose
+        self.formatter = formatter
+        self.cache = cache
+        self.stats = stats or NULL_STATS
+        self.assets = AssetStore(assets)
         self.log = logger if logger else logging.getLogger(__name__)
+        self.fast = fast
+
+    def reset(self) -> None:
+        """Forgets everything parsed so far, so the converter can be reused."""
+        super().reset()
         self.doc = Document(doctype=None, children=[])
         self._elem = self.doc
-        self.raw_files: t.List[RawFile] = []
-        self.fast = fast
-        self.black_file_mode: black.FileMode = black.FileMode(
-            target_versions={}, is_pyi=False, line_length=79, string_normalization=True
-        )
+        self._parents: t.List[t.Union[CompositeTag, Document]] = []
+        # Keyed by content, so repeated scripts and styles share one renderer.
+        self.raw_files: t.Dict[str, RawFile] = {}
 
     def handle_decl(self, decl) -> None:
         if decl.lower().startswith("doctype "):
@@ -129,23 +329,36 @@ class Converter(HTMLParser, PConverter):
         tagname = None if self._elem is self.doc else self._elem.tagname
 
         if tagname in ["script", "style", "textarea"]:
-            rf = RawFile(f"raw{len(self.raw_files)}", data)
-            self.raw_files.append(rf)
-            self._elem.children.append(
-                Txt(parent=self._elem, content=f"{{{rf.varname}}}")
-            )
+            if data not in self.raw_files:
+                self.raw_files[data] = RawFile(f"raw{len(self.raw_files)}", data)
+            rf = self.raw_files[data]
+            self.stats.count("texts")
+            self.count_node(len(self._parents))
+            self._elem.children.append(Txt(content=f"{{{rf.varname}}}"))
             return
 
-        self._elem.children.append(Txt(parent=self._elem, content=data))
+        # Like htmlmin, drop blanks in the head and right after the doctype.
+        after_doctype = self.doc.doctype is not None and not self.doc.children
+        data = self.collapse_whitespace(
+            data,
+            strip=tagname == "title",
+            drop_blank=tagname == "head" or (tagname is None and after_doctype),
+        )
+        if data:
+            self.stats.count("texts")
+            self.count_node(len(self._parents))
+            self._elem.children.append(Txt(content=data))
 
-    def _attributes(self, attrs):
-        return {k: (True if v is None else v) for k, v in attrs}
+    def _attributes(self, attrs) -> Attributes:
+        return tuple((sys.intern(k), True if v is None else v) for k, v in attrs)
 
     def handle_startendtag(self, tag, attrs):
         tag = tag.lower()
-        self.log.debug(f"Handling leaf tag: {tag}")
+        self.log.debug("Handling leaf tag: %s", tag)
+        self.stats.count("elements")
+        self.count_node(len(self._parents) + 1)
         self._elem.children.append(
-            LeafTag(parent=self._elem, tagname=tag, attributes=self._attributes(attrs))
+            LeafTag(tagname=tag, attributes=self._attributes(attrs))
         )
 
     def handle_starttag(self, tag, attrs):
@@ -153,54 +366,78 @@ class Converter(HTMLParser, PConverter):
         if tag in LEAF_TAGS:
             self.handle_startendtag(tag, attrs)
             return
-        self.log.debug(f"Starting composite tag: {tag}")
+        self.log.debug("Starting composite tag: %s", tag)
+        self.stats.count("elements")
+        self._parents.append(self._elem)
+        self.count_node(len(self._parents))
         self._elem.children.append(
-            CompositeTag(
-                parent=self._elem,
-                tagname=tag,
-                attributes=self._attributes(attrs),
-                children=[],
-            )
+            CompositeTag(tagname=tag, attributes=self._attributes(attrs), children=[])
         )
         self._elem = self._elem.children[-1]
+        self.enter_tag(tag)
 
     def handle_endtag(self, tag):
         tag = tag.lower()
-        if self._elem is self.doc or not self._elem or not self._elem.parent:
+        if not self._parents:
             raise ValueError(f"Tag closed before starting: {tag}")
 
-        self.log.debug(f"Closing composite tag: {tag}")
+        self.log.debug("Closing composite tag: %s", tag)
         if tag != self._elem.tagname:
-            warnings.warn(f"Tag was never closed: {self._currtag.tagname}", Warning)
-        self._elem = self._elem.parent
+            self.diagnostics.add("mismatched end tag", tag)
+        self.leave_tag(tag)
+        self._elem = self._parents.pop()
 
-    def convert(self, raw_html):
-        self.feed(minify(raw_html, remove_empty_space=True))
-
-        p = Path("assets")
-        if not p.exists():
-            p.mkdir()
+    def iter_generate(self) -> t.Iterator[str]:
+        # The module is small, the document itself is streamed to the assets.
+        if self._parents:
+            for elem in self._parents[1:] + [self._elem]:
+                self.diagnostics.add("unclosed tag", elem.tagname)
 
         raw_renderers = []
         raw_elements = {}
+        written = self.assets.written
+
+        self.check_time()
+        with self.stats.phase("render"):
+            # The assets count towards the output limit too.
+            output = 0
+            for rf in self.raw_files.values():
+                output += utf8_size(rf.content)
+                self.count_output(output)
+                filename = self.assets.put(rf.content, suffix=".txt")
+                raw_renderers.append(
+                    RENDERER_TEMPLATE.format(varname=rf.varname, filename=filename)
+                )
+                raw_elements[rf.varname] = RendererCall(rf.varname)
+
+            with self.assets.writer(suffix=".yml") as f:
+                dump_document(self.doc, f)
+                self.count_output(output + f.size)
+
+        self.stats.count("assets", len(self.raw_files) + 1)
+        self.stats.count("assets_written", self.assets.written - written)
+
+        with self.stats.phase("template"):
+            document = format_statement(
+                f"return {repr(raw_elements)}",
+                formatter=self.formatter,
+                fast=self.fast,
+                depth=1,
+                cache=self.cache,
+            )
 
-        for rf in self.raw_files:
-            fpath = str(p / f"{rf.varname}.txt")
-
-            raw_renderers.append(RENDERER_TEMPLATE.format(varname=rf.varname))
-            raw_elements[rf.varname] = RendererCall(rf.varname)
-
-            with open(fpath, "w") as f:
-                f.write(rf.content)
-
-        with open(str(p / "components.yml"), "w") as f:
-            dump(self.doc.render(), f)
-
-        result = TEMPLATE.format(
-            doctype=self.doc.doctype if self.doc.doctype else "html",
-            raw_renderers="\n".join(raw_renderers),
-            raw_elements=repr(raw_elements),
-        )
-        return black.format_file_contents(
-            result, fast=self.fast, mode=self.black_file_mode
-        )
+            result = TEMPLATE.format(
+                assets=normalize_string_quotes(repr(self.assets.directory)),
+                components=f.name,
+                doctype=self.doc.doctype if self.doc.doctype else "html",
+                raw_renderers="".join(raw_renderers),
+                document=document,
+            )
+            result = result.lstrip("\n")
+
+        if self.formatter is Formatter.verify:
+            with self.stats.phase("black"):
+                result = verify_with_black(
+                    result, fast=self.fast, mode=self.black_file_mode, logger=self.log
+                )
+        yield result
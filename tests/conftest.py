@@ -0,0 +1,101 @@
+import threading
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from moodlmth.const import Formatter, Syntax
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Serves a page naming its path, and a 404 for "/missing".
+
+    With a `version`, pages carry it and an ETag to revalidate them with.
+    The connections and response statuses are recorded.
+    """
+
+    protocol_version = "HTTP/1.1"
+    version = None
+    connections = set()
+    statuses = []
+
+    def do_GET(self):
+        PageHandler.connections.add(self.client_address)
+        if self.path == "/missing":
+            self.reply(404)
+            return
+
+        body = f"<html><body>{self.path}</body></html>"
+        headers = {"Content-Type": "text/html; charset=utf-8"}
+        if PageHandler.version is not None:
+            body = f"<html><body>{self.path} v{PageHandler.version}</body></html>"
+            headers["ETag"] = f'"{PageHandler.version}"'
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                self.reply(304, headers={"ETag": headers["ETag"]})
+                return
+        self.reply(200, body.encode(), headers)
+
+    def reply(self, status, body=b"", headers=None):
+        PageHandler.statuses.append(status)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def page_handler():
+    PageHandler.version, PageHandler.connections, PageHandler.statuses = None, set(), []
+    return PageHandler
+
+
+@pytest.fixture
+def server(page_handler):
+    httpd = Server(("127.0.0.1", 0), page_handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def make_options():
+    def make_options(**overrides):
+        options = dict(
+            syntax=Syntax.python,
+            fast=False,
+            htmlmin=False,
+            formatter=Formatter.native,
+            format_cache=None,
+            assets="assets",
+            dedupe=4,
+            static=False,
+            chunk_size=None,
+            max_bytes=None,
+            max_depth=None,
+            max_nodes=None,
+            max_output=None,
+            max_time=None,
+            stats=None,
+            debug=False,
+            concurrency=2,
+            timeout=5,
+            http_cache=None,
+            http_cache_size=1,
+        )
+        options.update(overrides)
+        return Namespace(**options)
+
+    return make_options
@@ -0,0 +1,91 @@
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from moodlmth.batch import Result, convert_many, expand_targets, plan_jobs, run
+from moodlmth.const import Syntax
+
+
+def test_expand_targets(tmp_path):
+    (tmp_path / "a.html").write_text("<p>a</p>")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.htm").write_text("<p>b</p>")
+    (tmp_path / "notes.txt").write_text("not html")
+
+    assert list(expand_targets([str(tmp_path)])) == [
+        (str(tmp_path / "a.html"), "a"),
+        (str(tmp_path / "sub" / "b.htm"), os.path.join("sub", "b")),
+    ]
+    assert list(expand_targets([str(tmp_path / "*.html")])) == [
+        (str(tmp_path / "a.html"), "a")
+    ]
+    assert list(expand_targets(["https://example.com/a/b?x=1"])) == [
+        ("https://example.com/a/b?x=1", "example.com_a_b_x_1")
+    ]
+
+
+def test_plan_jobs_unique_destinations():
+    jobs = plan_jobs(["x/index.html", "y/index.html"], "out")
+    assert [j.destination for j in jobs] == [
+        os.path.join("out", "index.py"),
+        os.path.join("out", "index-1.py"),
+    ]
+
+
+def test_run_reports_failures(make_options, tmp_path):
+    good = tmp_path / "good.html"
+    good.write_text("<html><body>Hello</body></html>")
+    jobs = plan_jobs([str(good), str(tmp_path / "missing.html")], str(tmp_path))
+
+    results = {r.source: r for r in run(jobs, make_options(), workers=2)}
+
+    assert results[str(good)].ok
+    assert (tmp_path / "good.py").read_text().startswith("from htmldoom")
+    assert not results[str(tmp_path / "missing.html")].ok
+    assert "FileNotFoundError" in results[str(tmp_path / "missing.html")].error
+
+
+def test_run_yields_files_while_fetching(make_options, tmp_path):
+    good = tmp_path / "good.html"
+    good.write_text("<html><body>Hello</body></html>")
+    jobs = plan_jobs([str(good), "https://example.com/a"], str(tmp_path))
+    fetched = threading.Event()
+
+    def fetch(url_jobs, options):
+        # The download only finishes once the file's result is out.
+        assert fetched.wait(5)
+        for job in url_jobs["https://example.com/a"]:
+            yield job, None, None, Result(job.source, job.destination, "Offline")
+
+    with patch("moodlmth.batch._fetch", fetch):
+        results = run(jobs, make_options(), workers=1)
+        assert next(results).source == str(good)
+        fetched.set()
+        assert next(results).error == "Offline"
+        assert next(results, None) is None
+
+
+def test_convert_many():
+    documents = [f"<html><body><p>{i}</p></body></html>" for i in range(9)]
+    documents[4] = "</div>"
+
+    results = list(convert_many(iter(documents), workers=2, ordered=True, chunksize=2))
+    assert [r.index for r in results] == list(range(9))
+    assert not results[4].ok
+    assert results[4].error.startswith("ValueError")
+    assert all(r.ok for i, r in enumerate(results) if i != 4)
+    assert 'e.p()("7")' in results[7].output
+
+    unordered = convert_many(documents, syntax=Syntax.python, workers=2, fast=True)
+    assert sorted(r.index for r in unordered) == list(range(9))
+
+
+def test_convert_many_rejects_unpicklable_options():
+    import moodlmth
+    from moodlmth.cache import FormatCache
+
+    assert moodlmth.convert_many is convert_many
+    with pytest.raises(ValueError, match="Options must be picklable"):
+        convert_many(["<p>x</p>"], cache=FormatCache())
@@ -0,0 +1,54 @@
+import os
+import time
+
+from moodlmth.cache import FormatCache
+
+
+def test_lru_eviction():
+    cache = FormatCache(max_memory=4)
+    cache.put("a", "1")
+    cache.put("b", "22")
+    assert cache.get("a") == "1"
+    cache.put("c", "333")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "333"
+
+    # Too large to be kept at all.
+    cache.put("d", "55555")
+    assert (cache.get("d"), cache.get("a")) == (None, "1")
+
+
+def test_directory_eviction(tmp_path):
+    cache = FormatCache(max_memory=0, directory=str(tmp_path), max_size=250)
+    for key in ("aa", "bb", "cc"):
+        cache.put(key, "x" * 100)
+        time.sleep(0.01)
+
+    assert cache.get("aa") is None
+    assert cache.get("bb") == cache.get("cc") == "x" * 100
+    sizes = [len(files) for _, _, files in os.walk(str(tmp_path))]
+    assert sum(sizes) == 2
+
+
+def test_get_or_format_counts_hits_and_misses():
+    cache = FormatCache()
+    calls = []
+
+    def format_():
+        calls.append(1)
+        return "formatted"
+
+    key = cache.key("native", "@renders(e.p()('x'))")
+    assert cache.get_or_format(key, format_) == "formatted"
+    assert cache.get_or_format(key, format_) == "formatted"
+    assert (cache.hits, cache.misses, len(calls)) == (1, 1, 1)
+
+
+def test_directory_is_shared(tmp_path):
+    FormatCache(directory=str(tmp_path)).put("abcd", "formatted")
+
+    cache = FormatCache(directory=str(tmp_path))
+    assert cache.get_or_format("abcd", lambda: "other") == "formatted"
+    assert cache.hits == 1
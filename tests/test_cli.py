@@ -1,3 +1,55 @@
+import os
+import subprocess
+import sys
+from argparse import ArgumentError
+from unittest.mock import patch
+
+import pytest
+
 from moodlmth.cli import main
 
-# TODO: Write tests
+
+def test_heavy_dependencies_are_lazy():
+    code = (
+        "import sys, moodlmth.cli;"
+        "print(' '.join(m for m in ('requests', 'black', 'htmlmin', 'yaml',"
+        " 'moodlmth.batch') if m in sys.modules))"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", code], stdout=subprocess.PIPE, check=True
+    )
+    assert proc.stdout.strip() == b""
+
+
+def test_invalid_target(tmp_path):
+    missing = str(tmp_path / "missing.html")
+    for argv in (["moodlmth", missing], ["moodlmth", "--stream", missing]):
+        with patch.object(sys, "argv", argv), pytest.raises(ArgumentError) as e:
+            main()
+        assert str(e.value) == f"Invalid target: {missing}"
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_watch_rebuilds_changed_targets(mocked_warn, tmp_path):
+    src, out = tmp_path / "src", tmp_path / "out"
+    src.mkdir()
+    (src / "a.html").write_text("<html><body>a</body></html>")
+    (src / "b.html").write_text("<html><body>b</body></html>")
+    built = {}
+
+    def sleep(seconds):
+        # Change one input after the first build, stop after one rebuild.
+        if built:
+            raise KeyboardInterrupt
+        built.update({p.name: os.stat(p) for p in out.iterdir()})
+        (src / "a.html").write_text("<html><body>changed</body></html>")
+
+    argv = ["moodlmth", str(src), "-d", str(out), "--watch", "5"]
+    with patch.object(sys, "argv", argv), patch("time.sleep", sleep):
+        main()
+
+    assert set(built) == {"a.py", "b.py"}
+    assert 'e.body()("changed")' in (out / "a.py").read_text()
+    # Outputs are replaced when written, so an unchanged inode means untouched.
+    assert os.stat(out / "a.py").st_ino != built["a.py"].st_ino
+    assert os.stat(out / "b.py").st_ino == built["b.py"].st_ino
@@ -0,0 +1,56 @@
+from moodlmth.emitter import format_line, normalize_string_quotes
+
+
+def test_short_line_is_kept():
+    assert format_line("@renders(e.p()('Hello'))") == '@renders(e.p()("Hello"))'
+
+
+def test_nested_calls_are_split_from_the_right():
+    source = (
+        "@renders(e.div(id_='main')(e.form(action='/', method='POST')("
+        "e.textarea('required'), e.input_('required', name='test', type_='text'), "
+        "e.button(type_='submit')('submit'))))"
+    )
+    assert format_line(source) == (
+        "@renders(\n"
+        '    e.div(id_="main")(\n'
+        '        e.form(action="/", method="POST")(\n'
+        '            e.textarea("required"),\n'
+        '            e.input_("required", name="test", type_="text"),\n'
+        '            e.button(type_="submit")("submit"),\n'
+        "        )\n"
+        "    )\n"
+        ")"
+    )
+
+
+def test_short_trailer_stays_on_tail():
+    source = (
+        "@renders(e.a(href='https://example.com/a/very/long/path/that/goes/on', "
+        "class_='navigation-link')('Home'))"
+    )
+    assert format_line(source) == (
+        "@renders(\n"
+        "    e.a(\n"
+        '        href="https://example.com/a/very/long/path/that/goes/on",\n'
+        '        class_="navigation-link",\n'
+        '    )("Home")\n'
+        ")"
+    )
+
+
+def test_dict_is_exploded():
+    source = "return {%s}" % ", ".join(f"'raw{i}': raw{i}()" for i in range(5))
+    assert format_line(source, depth=1) == "\n".join(
+        ["    return {"]
+        + [f'        "raw{i}": raw{i}(),' for i in range(5)]
+        + ["    }"]
+    )
+
+
+def test_normalize_string_quotes():
+    assert normalize_string_quotes("'a'") == '"a"'
+    assert normalize_string_quotes("b'{{}}'") == 'b"{{}}"'
+    assert normalize_string_quotes("'say \"hi\"'") == "'say \"hi\"'"
+    assert normalize_string_quotes("'it\\'s'") == '"it\'s"'
+    assert normalize_string_quotes("'it\\'s \"x\"'") == "'it\\'s \"x\"'"
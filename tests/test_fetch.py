@@ -0,0 +1,16 @@
+def test_fetch_many(server, page_handler):
+    from moodlmth.fetch import Fetcher
+
+    urls = [f"{server}/page{i}" for i in range(20)] + [f"{server}/missing"]
+    with Fetcher(concurrency=4, timeout=5) as fetcher:
+        results = {
+            url: (content, error) for url, content, error in fetcher.fetch_many(urls)
+        }
+
+    assert len(results) == 21
+    assert results[f"{server}/page3"] == ("<html><body>/page3</body></html>", None)
+    assert results[f"{server}/missing"][0] is None
+    assert "404" in results[f"{server}/missing"][1]
+
+    # Keep-alive: connections are reused instead of opened per request.
+    assert len(page_handler.connections) <= 4
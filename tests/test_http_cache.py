@@ -0,0 +1,63 @@
+import os
+import time
+
+from moodlmth.batch import plan_jobs, run
+from moodlmth.http_cache import CachedOutput, HTTPCache, Revalidated
+
+
+def test_unchanged_pages_reuse_their_output(
+    server, page_handler, make_options, tmp_path
+):
+    jobs = plan_jobs([f"{server}/a", f"{server}/b"], str(tmp_path / "out"))
+    options = make_options(http_cache=str(tmp_path / "cache"))
+
+    def convert():
+        assert all(result.ok for result in run(jobs, options, workers=1))
+        return {job.source: open(job.destination).read() for job in jobs}
+
+    page_handler.version = "1"
+    first = convert()
+    assert page_handler.statuses == [200, 200]
+    assert all("v1" in output for output in first.values())
+
+    os.remove(jobs[0].destination)
+    assert convert() == first
+    assert page_handler.statuses[2:] == [304, 304]
+
+    page_handler.version = "2"
+    assert all("v2" in output for output in convert().values())
+    assert page_handler.statuses[4:] == [200, 200]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    cache.put("settings", CachedOutput("url0", '"0"', None, "x" * 300))
+    # Room for three entries only.
+    cache._disk.max_size = 3 * os.path.getsize(cache._path("url0", "settings")) + 10
+    for i in range(3):
+        cache.put("settings", CachedOutput(f"url{i}", f'"{i}"', None, "x" * 300))
+        time.sleep(0.01)
+    assert cache.get("url0", "settings").etag == '"0"'
+    time.sleep(0.01)
+
+    cache.put("settings", CachedOutput("url3", None, "today", "x" * 300))
+    assert cache.get("url1", "settings") is None
+    assert cache.get("url0", "settings").output == "x" * 300
+    assert cache.get("url3", "settings").last_modified == "today"
+    assert cache.get("url0", "other settings") is None
+
+
+def test_cache_size_is_scanned_once_per_process(make_options, tmp_path):
+    from unittest.mock import patch
+
+    from moodlmth.cache import BoundedDirectory
+    from moodlmth.cli import load_http_cache
+
+    options = make_options(http_cache=str(tmp_path))
+    page = Revalidated(etag='"1"')
+    with patch.object(BoundedDirectory, "_scan", autospec=True) as scan:
+        scan.return_value = ([], 0)
+        for i in range(5):
+            load_http_cache(options).store(f"url{i}", "settings", page, "x")
+    assert scan.call_count == 1
+    assert load_http_cache(options).get("url4", "settings").output == "x"
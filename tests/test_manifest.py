@@ -0,0 +1,58 @@
+import os
+
+from moodlmth.batch import Result, plan_jobs
+from moodlmth.manifest import Manifest
+
+
+def convert(manifest, jobs, fail=()):
+    stale = manifest.stale(jobs)
+    for job in stale:
+        if job.source in fail:
+            manifest.record(Result(job.source, job.destination, error="Error"))
+            continue
+        with open(job.destination, "w") as f:
+            f.write("output")
+        manifest.record(Result(job.source, job.destination))
+    manifest.save()
+    return sorted(os.path.basename(job.source) for job in stale)
+
+
+def test_only_changed_inputs_are_stale(tmp_path):
+    for name in "abc":
+        (tmp_path / f"{name}.html").write_text(f"<p>{name}</p>")
+    jobs = plan_jobs([str(tmp_path / "*.html")], str(tmp_path))
+    path = str(tmp_path / "manifest.json")
+
+    assert convert(Manifest(path, "v1"), jobs) == ["a.html", "b.html", "c.html"]
+    assert convert(Manifest(path, "v1"), jobs) == []
+
+    # Touched without changes, modified, and lost its output.
+    os.utime(tmp_path / "a.html", ns=(0, 0))
+    (tmp_path / "b.html").write_text("<p>B</p>")
+    os.remove(tmp_path / "c.py")
+    manifest = Manifest(path, "v1")
+    assert convert(manifest, jobs, fail={str(tmp_path / "b.html")}) == [
+        "b.html",
+        "c.html",
+    ]
+    assert manifest.entries[str(tmp_path / "a.html")].mtime == 0
+
+    # Failed conversions are retried, other settings reconvert everything.
+    assert convert(Manifest(path, "v1"), jobs) == ["b.html"]
+    assert convert(Manifest(path, "v2"), jobs) == ["a.html", "b.html", "c.html"]
+
+
+def test_urls_and_unreadable_manifests(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text("not json")
+    (tmp_path / "a.html").write_text("<p>a</p>")
+    jobs = plan_jobs([str(tmp_path / "a.html"), "https://example.com"], str(tmp_path))
+
+    manifest = Manifest(str(path), "v1")
+    assert manifest.stale(jobs) == jobs
+    manifest.save()
+    assert path.read_text() == "not json"
+
+    manifest = Manifest(None, "v1")
+    assert convert(manifest, jobs[:1]) == ["a.html"]
+    assert convert(manifest, jobs[:1]) == []
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_converter_is_reusable(mocked_warn):
+    from moodlmth.py_converter import Converter, tag_tables
+
+    html = "<html><head><title>Hi</title></head><body><x-foo>a</x-foo></body></html>"
+    converter = Converter()
+    first = converter.convert(html)
+
+    assert converter.convert(html) == first == Converter().convert(html)
+    assert mocked_warn.call_count == 3
+    assert "x-foo" not in tag_tables()[0]
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_pool(mocked_warn):
+    from moodlmth.pool import ConverterPool
+    from moodlmth.py_converter import Converter
+
+    pool = ConverterPool(Converter, size=2)
+    pages = [f"<html><body><p>{i}</p></body></html>" for i in range(20)]
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(pool.convert, pages))
+
+    assert results == [Converter().convert(page) for page in pages]
+    assert pool._created <= 2
+
+
+def test_pool_size():
+    from moodlmth.pool import ConverterPool
+
+    with pytest.raises(ValueError):
+        ConverterPool(object, size=0)
@@ -1,3 +1,4 @@
+import sys
 from unittest.mock import patch
 
 import pytest
@@ -88,7 +89,13 @@ if __name__ == "__main__":
 """
 
 
-@patch("moodlmth.py_converter.warnings.warn")
+def render(code):
+    namespace = {}
+    exec(code, namespace)
+    return namespace["render"]({})
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
 def test_convert(mocked_warn):
     from moodlmth.py_converter import Converter
 
@@ -111,9 +118,246 @@ def test_value_err():
         Converter().convert("</div>")
 
 
-@patch("moodlmth.py_converter.warnings.warn")
+@patch("moodlmth.diagnostics.warnings.warn")
 def test_tag_never_closed(mocked_warn):
     from moodlmth.py_converter import Converter
 
     Converter().convert("<html><p></html>")
     assert mocked_warn.called
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_convert_stream(mocked_warn):
+    from moodlmth.py_converter import Converter
+
+    html = "<html><head><title>tést</title></head><body><p>ünïcode</p></body></html>"
+    data = html.encode()
+    chunks = (data[i : i + 1] for i in range(len(data)))
+
+    assert Converter().convert_stream(chunks) == Converter().convert(html)
+
+    # A text node cut by chunk boundaries stays one node.
+    html = "<html><body><p>split across chunks</p></body></html>"
+    result = Converter().convert_stream(c.encode() for c in html)
+    assert 'e.p()("split across chunks")' in result
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_convert_to(mocked_warn):
+    import io
+
+    from moodlmth.const import Formatter
+    from moodlmth.limits import LimitExceeded, Limits
+    from moodlmth.py_converter import Converter
+    from moodlmth.stats import Stats
+
+    for options in [{}, {"static": True}, {"formatter": Formatter.verify}]:
+        stream, stats = io.StringIO(), Stats()
+        Converter(stats=stats, **options).convert_to(raw_html, stream)
+        assert stream.getvalue() == Converter(**options).convert(raw_html)
+        assert stats.counters["bytes_out"] == len(stream.getvalue().encode())
+
+    stream = io.StringIO()
+    Converter().convert_stream_to(iter([raw_html.encode()]), stream)
+    assert stream.getvalue() == Converter().convert(raw_html)
+
+    with pytest.raises(LimitExceeded, match="max_output"):
+        Converter(limits=Limits(max_output=1000)).convert_to(raw_html, io.StringIO())
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        raw_html,
+        '<html><head><meta charset="utf-8"> <title> t </title> <link rel="a" href="b">'
+        "</head> <body><div>a</div> <p>b</p>\n<p> c  d </p></body> </html>",
+        "<!DOCTYPE html>\n<html>\n <head>\n  <title>t</title>\n </head>\n"
+        " <body>\n  <div> a <b>b</b> </div>\n  <p>c</p> <p>d</p>\n </body>\n</html>",
+        "<!DOCTYPE html> <html> <head> <title>t</title> </head> <body> </body> </html> ",
+    ],
+)
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_whitespace_matches_htmlmin(mocked_warn, html):
+    from moodlmth.py_converter import Converter
+
+    assert Converter().convert(html) == Converter(htmlmin=True).convert(html)
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_native_formatting_matches_black(mocked_warn):
+    from moodlmth.const import Formatter
+    from moodlmth.py_converter import Converter
+
+    native = Converter(formatter=Formatter.native).convert(raw_html)
+    assert native == Converter(formatter=Formatter.black).convert(raw_html)
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_format_cache(mocked_warn):
+    from moodlmth.cache import FormatCache
+    from moodlmth.py_converter import Converter
+
+    cache = FormatCache()
+    first = Converter(cache=cache).convert(raw_html)
+    assert (cache.hits, cache.misses) == (0, 5)
+
+    assert Converter(cache=cache).convert(raw_html) == first == expected_result
+    assert (cache.hits, cache.misses) == (5, 5)
+
+
+def test_iter_code_escapes_once():
+    from moodlmth.py_converter import TagLeaf, TagNode
+
+    head = TagNode("e.head")
+    head.addchild(TagNode("e.title"))
+    head.addchild(TagNode("e.script"))
+    head.children[-1].addchild(TagLeaf("b.raw", value="{}"))
+    head.addchild(TagNode("e.body"))
+
+    assert head.render() == 'e.head("{title}", e.script(b\'{}\'), "{body}")'
+    assert "".join(head.iter_code(("title",))) == (
+        'e.head("{title}", e.script(b\'{{}}\'), "{{body}}")'
+    )
+
+
+def test_deeply_nested_document():
+    from moodlmth.py_converter import Converter
+
+    depth = sys.getrecursionlimit() + 100
+    raw_html = "<html><body>" + "<div>" * depth + "x" + "</div>" * depth
+    raw_html += "</body></html>"
+
+    result = Converter().convert(raw_html)
+    assert result.count("e.div()(") == depth
+
+
+def test_tree_nodes_are_compact():
+    from moodlmth.py_converter import TagLeaf, TagNode
+
+    node = TagNode("e.div")
+    assert not hasattr(node, "__dict__")
+    assert not hasattr(TagLeaf("b.txt"), "__dict__")
+    assert node.children == ()
+
+    node.addchild(TagLeaf("b.txt", value="x"))
+    assert node.render() == "e.div('x')"
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_stats(mocked_warn):
+    from moodlmth.py_converter import Converter
+    from moodlmth.stats import Stats
+
+    reports = []
+    stats = Stats(callback=lambda s: reports.append(s.asdict()))
+    result = Converter(stats=stats).convert(raw_html)
+
+    assert len(reports) == 1
+    assert set(stats.phases) == {"parse", "render", "template"}
+    assert stats.counters["bytes_in"] == len(raw_html.encode())
+    assert stats.counters["bytes_out"] == len(result.encode())
+    assert stats.counters["conversions"] == 1
+    assert stats.counters["elements"] > 0
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_diagnostics_are_reported_once(mocked_warn):
+    from moodlmth.py_converter import Converter
+
+    converter = Converter()
+    converter.convert(
+        "<html><body><x-card class='a'><x-card></x-card></x-card>"
+        "<div><p></div></body></html>"
+    )
+
+    assert converter.diagnostics.summary() == {
+        "unknown tag": {"x-card": 2},
+        "renamed attribute": {"class -> class_": 1},
+        "mismatched end tag": {"div": 1, "body": 1, "html": 1},
+        "unclosed tag": {"html": 1},
+    }
+    assert mocked_warn.call_count == 3
+
+    mocked_warn.reset_mock()
+    Converter(diagnose=False).convert("<html><body><x-card></x-card></body></html>")
+    assert not mocked_warn.called
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_repeated_subtrees_are_defined_once(mocked_warn):
+    from moodlmth.py_converter import Converter
+
+    item = "<li><a href='/'>Home {x}</a> <b>x</b></li>"
+    raw_html = f"<html><body><ul>{item * 3}</ul><ul>{item * 3}</ul></body></html>"
+
+    result = Converter().convert(raw_html)
+    assert result.count('e.a(href="/")') == 1
+    assert '_c1 = e.li()(e.a(href="/")("Home {{x}}"), " ", e.b()("x"))' in result
+    assert "_c0 = e.ul()(_c1, _c1, _c1)" in result
+    assert result.index("_c1 =") < result.index("_c0 =")
+    assert "e.body()(e.body()(_c0, _c0))" in result
+
+    inlined = Converter(dedupe=0).convert(raw_html)
+    assert inlined.count('e.a(href="/")') == 6
+    assert "_c0" not in inlined
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_static_renders_the_same_html(mocked_warn):
+    from moodlmth.const import Formatter
+    from moodlmth.py_converter import Converter
+
+    result = Converter(static=True).convert(raw_html)
+    assert "e." not in result.split("doctype =")[1]
+    assert '<head><meta charset="utf-8" />{title}<script>{{}}</script></head>' in result
+    assert render(result) == render(Converter().convert(raw_html))
+    assert result == Converter(static=True, formatter=Formatter.black).convert(raw_html)
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_chunks_render_the_same_html(mocked_warn):
+    from moodlmth.const import Formatter
+    from moodlmth.py_converter import Converter
+
+    result = Converter(chunk_size=3).convert(raw_html)
+    assert "def _p0():\n    return b.raw(_render(" in result
+    assert render(result) == render(Converter().convert(raw_html))
+    assert result == Converter(chunk_size=3, formatter=Formatter.black).convert(
+        raw_html
+    )
+
+    # Nesting deeper than the parser allows in one expression.
+    nested = "<!DOCTYPE html><html><body>" + "<b>" * 500 + "</b>" * 500
+    result = Converter(chunk_size=50).convert(nested + "</body></html>")
+    assert render(result).count("<b>") == 500
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_limits(mocked_warn):
+    from moodlmth.limits import LimitExceeded, Limits
+    from moodlmth.py_converter import Converter
+
+    def convert(html, **limits):
+        return Converter(limits=Limits(**limits)).convert(html)
+
+    nested = "<html><body>" + "<div>" * 50 + "x" + "</div>" * 50 + "</body></html>"
+    assert convert(nested, max_depth=52, max_nodes=53)
+    with pytest.raises(LimitExceeded, match="max_depth limit of 51"):
+        convert(nested, max_depth=51)
+    with pytest.raises(LimitExceeded, match="max_nodes"):
+        convert(nested, max_nodes=52)
+    with pytest.raises(LimitExceeded, match="max_bytes"):
+        convert("<p>é</p>", max_bytes=8)
+    assert convert("<p>é</p>", max_bytes=9)
+    with pytest.raises(LimitExceeded, match="max_output"):
+        convert(raw_html, max_output=1000)
+    with pytest.raises(LimitExceeded, match="timeout"):
+        convert("<p>x</p>" * 1000, timeout=0)
+
+    # Streamed input is rejected as soon as it goes over, unread.
+    def chunks():
+        while True:
+            yield b"<p>x</p>"
+
+    with pytest.raises(LimitExceeded, match="max_bytes"):
+        Converter(limits=Limits(max_bytes=1000)).convert_stream(chunks())
@@ -0,0 +1,127 @@
+import io
+import json
+import threading
+from http.client import HTTPConnection
+from unittest.mock import patch
+
+import pytest
+
+
+def make_service(**kwargs):
+    from moodlmth.py_converter import Converter
+    from moodlmth.server import Service
+
+    return Service(lambda syntax, fast: Converter(fast=fast), **kwargs)
+
+
+@pytest.fixture
+def server():
+    from moodlmth.server import make_server
+
+    service = make_service(max_in_flight=2)
+    httpd = make_server(service, "127.0.0.1:0")
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield service, httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(port, request):
+    conn = HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("POST", "/convert", body=json.dumps(request))
+    resp = conn.getresponse()
+    return resp.status, json.loads(resp.read())
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_serve_lines(mocked_warn):
+    from moodlmth.const import Syntax
+    from moodlmth.py_converter import Converter
+    from moodlmth.server import serve_lines
+
+    html = "<html><body><p>Hello</p></body></html>"
+    requests = [{"id": i, "html": html} for i in range(10)]
+    requests.append({"id": "bad", "syntax": "python"})
+    infile = io.StringIO("\n".join(json.dumps(r) for r in requests) + "\n\nnope\n")
+    outfile = io.StringIO()
+
+    service = make_service(max_in_flight=3)
+    serve_lines(service, infile, outfile)
+
+    responses = [json.loads(line) for line in outfile.getvalue().splitlines()]
+    assert len(responses) == 12
+    by_id = {r.get("id"): r for r in responses}
+    assert by_id[0]["output"] == Converter().convert(html)
+    assert by_id["bad"]["error"] == 'ValueError: Expected "html" or "url"'
+    assert by_id[None]["error"].startswith("Invalid request")
+    # Converters are reused, never more than the documents in flight.
+    assert service.pool(Syntax.python, False)._created <= 3
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_http_server(mocked_warn, server):
+    service, port = server
+
+    status, response = post(port, {"id": 1, "html": "<html><body>Hi</body></html>"})
+    assert status == 200
+    assert response["id"] == 1
+    assert 'e.body()("Hi")' in response["output"]
+
+    status, response = post(port, {"html": "</div>"})
+    assert status == 422
+    assert response["error"].startswith("ValueError")
+
+
+def test_http_server_rejects_when_busy(server):
+    service, port = server
+
+    for _ in range(service.max_in_flight):
+        service.in_flight.acquire()
+    try:
+        with patch("moodlmth.server.SLOT_TIMEOUT", 0.01):
+            status, response = post(port, {"html": "<p>x</p>"})
+    finally:
+        for _ in range(service.max_in_flight):
+            service.in_flight.release()
+
+    assert status == 503
+    assert response == {"error": "Too many documents in flight"}
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_http_server_streams_html(mocked_warn, server):
+    from moodlmth.py_converter import Converter
+
+    service, port = server
+    html = "<html><body><p>Héllo</p></body></html>"
+
+    conn = HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request(
+        "POST",
+        "/convert?id=7&syntax=python",
+        body=html.encode(),
+        headers={"Content-Type": "text/html; charset=utf-8"},
+    )
+    resp = conn.getresponse()
+    assert resp.status == 200
+    assert json.loads(resp.read()) == {"id": "7", "output": Converter().convert(html)}
+
+
+def test_http_server_rejects_large_bodies(server):
+    service, port = server
+    service.max_body = 100
+
+    conn = HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.putrequest("POST", "/convert")
+    conn.putheader("Content-Length", str(10 ** 9))
+    conn.endheaders()
+    resp = conn.getresponse()
+    assert resp.status == 413
+    assert json.loads(resp.read()) == {"error": "Request body exceeds 100 bytes"}
+    assert resp.getheader("Connection") == "close"
+
+    conn = HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.putrequest("POST", "/convert")
+    conn.endheaders()
+    assert conn.getresponse().status == 411
@@ -0,0 +1,119 @@
+import io
+from unittest.mock import patch
+
+import pytest
+import yaml
+
+raw_html = """<!DOCTYPE html>
+<html>
+  <head><title> Hello </title><style>p { color: red }</style></head>
+  <body>
+    <div id="main" class="a b" hidden data-x="1"><p>yes <b>no</b> null 1.5</p></div>
+    <img src="x.png" alt><br>
+    <p>'quoted' "double" #hash a: b - item</p>
+    <pre>  keep
+   this</pre>
+  </body>
+</html>
+"""
+
+
+def parse(html):
+    from moodlmth.yaml_converter import Converter
+
+    converter = Converter()
+    converter.feed(html)
+    converter.close()
+    return converter.doc
+
+
+@pytest.mark.parametrize(
+    "html",
+    [raw_html, raw_html.replace("this", "ünïcode " * 20), "<p>" + "é" * 80 + "</p>"],
+)
+def test_dump_document_matches_yaml_dump(html):
+    from moodlmth.yaml_converter import dump_document
+
+    doc = parse(html)
+    stream = io.StringIO()
+    dump_document(doc, stream)
+
+    assert stream.getvalue() == yaml.dump(doc.render())
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        raw_html,
+        '<html><head><meta charset="utf-8"> <title> t </title> <link rel="a" href="b">'
+        "</head> <body><div>a</div> <p>b</p>\n<p> c  d </p></body> </html>",
+        "<!DOCTYPE html> <html> <head> <title>t</title> </head> <body> </body> </html> ",
+    ],
+)
+def test_whitespace_matches_htmlmin(html, tmp_path):
+    from moodlmth.yaml_converter import Converter
+
+    default = Converter(assets=str(tmp_path)).convert(html)
+    assert default == Converter(assets=str(tmp_path), htmlmin=True).convert(html)
+
+
+def test_escapes_that_may_fold_use_pyyaml():
+    from moodlmth.yaml_converter import may_fold_escapes
+
+    assert not may_fold_escapes(parse(raw_html))
+    assert not may_fold_escapes(parse("<p>ünïcode</p>"))
+    assert may_fold_escapes(parse("<p>" + "é" * 80 + "</p>"))
+
+
+def test_assets_are_content_addressed(tmp_path):
+    from moodlmth.yaml_converter import Converter
+
+    assets = tmp_path / "assets"
+    html = "<html><head><script>var x = 1;</script></head><body>{}</body></html>"
+    first = Converter(assets=str(assets)).convert(html.format("<p>One</p>"))
+    second = Converter(assets=str(assets)).convert(html.format("<p>Two</p>"))
+
+    assert first != second
+    assert f"ASSETS = {str(assets)!r}".replace("'", '"') in first
+    assert sorted(p.suffix for p in assets.iterdir()) == [".txt", ".yml", ".yml"]
+    assert Converter(assets=str(assets)).convert(html.format("<p>One</p>")) == first
+    assert len(list(assets.iterdir())) == 3
+
+
+def test_asset_store_put(tmp_path):
+    from moodlmth.assets import AssetStore
+
+    store = AssetStore(str(tmp_path))
+    name = store.put("body { color: red }")
+
+    assert name == AssetStore(str(tmp_path)).put("body { color: red }")
+    assert (tmp_path / name).read_text() == "body { color: red }"
+    assert [p.name for p in tmp_path.iterdir()] == [name]
+
+
+@patch("moodlmth.diagnostics.warnings.warn")
+def test_mismatched_end_tag(mocked_warn, tmp_path):
+    from moodlmth.yaml_converter import Converter
+
+    converter = Converter(assets=str(tmp_path))
+    converter.convert("<html><p></html>")
+
+    assert converter.diagnostics.summary() == {
+        "mismatched end tag": {"html": 1},
+        "unclosed tag": {"html": 1},
+    }
+    assert mocked_warn.call_count == 2
+
+
+def test_limits(tmp_path):
+    from moodlmth.limits import LimitExceeded, Limits
+    from moodlmth.yaml_converter import Converter
+
+    converter = Converter(assets=str(tmp_path), limits=Limits(max_depth=3))
+    assert converter.convert("<html><body><p>x</p></body></html>")
+    with pytest.raises(LimitExceeded, match="max_depth"):
+        converter.convert("<html><body><div><p>x</p></div></body></html>")
+
+    converter = Converter(assets=str(tmp_path), limits=Limits(max_output=100))
+    with pytest.raises(LimitExceeded, match="max_output"):
+        converter.convert("<html><body>" + "<p>x</p>" * 100 + "</body></html>")